@@ -4,25 +4,61 @@ Given a leading video and a list of following videos, searches the end
 of the leading and the beginning of the following  videos using one of four
 image similarity metrics, MSE, NRMSE, PSNR, SSIM.
 
+The heavy dependencies, OpenCV, scikit-image, joblib, and NumPy, are imported
+by the functions that need them, so the command line interface starts quickly.
+
   Typical usage example:
 
   best_matching_frames = find_matching_frames("path/to/vid1.avi", ["path/to/vid2.avi", "path/to/vid3.avi"],
                                               seconds=3, multichannel=False, downscale=True,
                                               method="mse", verbose=3)
 """
+from __future__ import annotations
 import os
 from typing import *
 import click
-from custom_params import PathList, Method
-import numpy as np
-import cv2 as cv
-from skimage.measure import compare_mse, compare_nrmse, compare_psnr, compare_ssim
-from skimage.transform import resize
-from skimage import img_as_ubyte
+from custom_params import PathList, Method, CropBox
 import warnings
 import time
 import datetime
-from joblib import Parallel, delayed
+import tempfile
+import hashlib
+import queue
+from concurrent.futures import ThreadPoolExecutor, Future
+from result_cache import ResultCache
+from frame_cache import FrameCache
+from audio_prefilter import get_audio_envelope, get_audio_band
+from memory_budget import (SpilledFrames, plan_tiles, get_memory_usage, get_peak_memory_usage,
+                           MEGABYTE, WORKING_MEMORY_FACTORS)
+
+if TYPE_CHECKING:
+    import numpy as np
+    import cv2 as cv
+
+# Number of videos decoded at a time by find_matching_frames,
+# and number of decoded following videos allowed to wait for the search
+NUMBER_OF_DECODERS: int = 2
+DECODED_QUEUE_SIZE: int = 2
+
+# Side of the Gaussian window compare_ssim uses with sigma=1.5, see run_ssim.
+# Frames compared with SSIM, and the bounding boxes of their masks, must be at least this large.
+SSIM_WINDOW_SIZE: int = 11
+
+# Number of leading frames compared to following frames outside the audio band, see is_band_consistent
+BAND_CHECK_FRAMES: int = 4
+
+
+def import_dependencies() -> None:
+    """Imports all heavy dependencies up front.
+
+    Used by long running processes, like the match daemon,
+    to pay the import cost once instead of on the first search.
+    """
+
+    import importlib
+
+    for module in ["numpy", "cv2", "joblib", "skimage.measure", "skimage.transform"]:
+        importlib.import_module(module)
 
 
 def resize_image(image: np.ndarray, new_height: int = 480) -> np.ndarray:
@@ -43,6 +79,9 @@ def resize_image(image: np.ndarray, new_height: int = 480) -> np.ndarray:
         Warning about precision loss is suppressed, but suppression might not always work.
     """
 
+    from skimage.transform import resize
+    from skimage import img_as_ubyte
+
     height: int = image.shape[0]
     width: int = image.shape[1]
     scale: float = new_height / height
@@ -57,7 +96,8 @@ def resize_image(image: np.ndarray, new_height: int = 480) -> np.ndarray:
 
 
 def get_frames(start: int, number_of_frames_to_read: int, video: cv.VideoCapture,
-               multichannel: bool = True, downscale: bool = False, verbose: int = 0) -> List[np.ndarray]:
+               multichannel: bool = True, downscale: bool = False, verbose: int = 0,
+               seek: bool = True, crop: Union[Tuple[int, int, int, int], None] = None) -> List[np.ndarray]:
     """Gets frames from video and returns them in a list.
 
     Gets number_of_frames_to_read number of frames starting from start
@@ -78,6 +118,12 @@ def get_frames(start: int, number_of_frames_to_read: int, video: cv.VideoCapture
                  If verbose >= 1 the function prints a notice
                  if the number of frames available after start is lower than
                  number_of_frames_to_read.
+        seek: A bool for selecting to jump to start before reading.
+              If False, reading continues from the current position of video,
+              which avoids a costly seek when reading consecutive blocks.
+        crop: A tuple of four ints, x, y, width, and height, of a rectangle in the original frames
+              to crop each frame to as soon as it's read, or None to keep the whole frames.
+              Downscaled crops are scaled by the same factor as whole frames would be.
 
     Returns:
         A list of ndarrays with length equal to number_of_frames_to_read,
@@ -92,10 +138,18 @@ def get_frames(start: int, number_of_frames_to_read: int, video: cv.VideoCapture
         available logical processors, to resize images if downscale is enabled.
     """
 
+    import numpy as np
+    import cv2 as cv
+
     # Init return variable
     out: List[np.ndarray] = []
+    full_height: int = 0
     # Jump to start frame
-    video.set(cv.CAP_PROP_POS_FRAMES, start)
+    if seek:
+        video.set(cv.CAP_PROP_POS_FRAMES, start)
+
+    if crop is not None:
+        crop_x, crop_y, crop_width, crop_height = crop
 
     # Read frames from the file,
     # if reading the frame is successful append it to the list, else stop reading frames
@@ -103,6 +157,11 @@ def get_frames(start: int, number_of_frames_to_read: int, video: cv.VideoCapture
         success, frame = video.read()
         if success:
 
+            full_height = frame.shape[0]
+            if crop is not None:
+                # Copy the cropped region, so the whole frame can be freed
+                frame = np.ascontiguousarray(frame[crop_y:crop_y + crop_height, crop_x:crop_x + crop_width])
+
             if multichannel:
                 out.append(frame)
             else:
@@ -114,6 +173,8 @@ def get_frames(start: int, number_of_frames_to_read: int, video: cv.VideoCapture
             break
 
     if downscale:
+        from joblib import Parallel, delayed
+
         # Try to set number of jobs to the number of available CPUs.
         # If os.cpu_count() failed and returned None,
         # default to 4 jobs, as that's good enough
@@ -124,17 +185,198 @@ def get_frames(start: int, number_of_frames_to_read: int, video: cv.VideoCapture
         if verbose >= 1:
             print("Resizing", len(out), "frames, using", number_of_jobs, "threads...")
 
+        new_height: int = 480
+        if out and crop is not None:
+            new_height = get_downscaled_height(out[0].shape[0], full_height)
+
         with Parallel(n_jobs=number_of_jobs, prefer="threads") as parallel:
-            resized_out = (parallel(delayed(resize_image)(frame, 480) for frame in out))
+            resized_out = (parallel(delayed(resize_image)(frame, new_height) for frame in out))
 
         return resized_out
     else:
         return out
 
 
+def get_downscaled_height(height: int, full_height: int) -> int:
+    """Returns the height of a region of a frame when the whole frame is downscaled to 480p."""
+    return max(1, int(height * 480 / full_height))
+
+
+def get_crop_box(video: cv.VideoCapture,
+                 crop: Union[Tuple[int, int, int, int], None]) -> Union[Tuple[int, int, int, int], None]:
+    """Fits a crop rectangle inside the frames of video.
+
+    Args:
+        video: An open OpenCV video capture.
+        crop: A tuple of four ints, x, y, width, and height, of a rectangle.
+
+    Returns:
+        A tuple of four ints, x, y, width, and height, of the part of crop inside the frames,
+        or None if crop is completely outside the frames.
+    """
+
+    import cv2 as cv
+
+    frame_height: int = int(video.get(cv.CAP_PROP_FRAME_HEIGHT))
+    frame_width: int = int(video.get(cv.CAP_PROP_FRAME_WIDTH))
+    x, y, width, height = crop
+    width = min(width, frame_width - x)
+    height = min(height, frame_height - y)
+    if width < 1 or height < 1:
+        return None
+    return x, y, width, height
+
+
+def get_frame_shape(video: cv.VideoCapture, multichannel: bool = True, downscale: bool = False,
+                    crop: Union[Tuple[int, int, int, int], None] = None) -> Tuple[int, ...]:
+    """Gets the shape of the frames get_frames would return from video.
+
+    Args:
+        video: An open OpenCV video capture.
+        multichannel: A bool for selecting colour or greyscale frames.
+        downscale: A bool for selecting frames downscaled to 480p.
+        crop: A tuple of four ints, x, y, width, and height, of a rectangle to crop to, or None.
+
+    Returns:
+        A tuple of ints representing the shape of a frame, (height, width, 3) for colour
+        frames or (height, width) for greyscale frames.
+    """
+
+    import cv2 as cv
+
+    full_height: int = int(video.get(cv.CAP_PROP_FRAME_HEIGHT))
+    height: int = full_height
+    width: int = int(video.get(cv.CAP_PROP_FRAME_WIDTH))
+    if crop is not None:
+        _, _, width, height = get_crop_box(video, crop) or (0, 0, 0, 0)
+    if downscale and height:
+        # Same calculation as resize_image
+        new_height: int = get_downscaled_height(height, full_height)
+        width = int(width * (new_height / height))
+        height = new_height
+
+    if multichannel:
+        return height, width, 3
+    else:
+        return height, width
+
+
+def get_frames_in_blocks(start: int, number_of_frames_to_read: int, video: cv.VideoCapture, block_size: int,
+                         spill_path: Union[str, None] = None, multichannel: bool = True, downscale: bool = False,
+                         verbose: int = 0, crop: Union[Tuple[int, int, int, int], None] = None,
+                         mask: Union[np.ndarray, None] = None,
+                         method: str = 'mse') -> Union[List[np.ndarray], SpilledFrames]:
+    """Gets frames from video a block at a time.
+
+    Works like get_frames, but only decodes block_size frames at a time,
+    so at most one block of full resolution frames is held in memory.
+    If spill_path is given, the frames are written to a scratch file
+    at spill_path instead of being kept in memory.
+    If mask is given, each block is reduced with mask_frames as it's decoded,
+    so only the compared pixels are stored.
+
+    Args:
+        start: An int representing the frame number to start from.
+        number_of_frames_to_read: An int representing the number of frames to read.
+        video: An open OpenCV video capture to read frames from.
+        block_size: An int representing the number of frames to decode at a time.
+        spill_path: A string representing the path to a scratch file, or None to keep frames in memory.
+        multichannel: A bool for selecting to extract colour or greyscale frames.
+        downscale: A bool for selecting to downscale extracted frames to 480p.
+        verbose: An int controlling the printing of detailed information, passed to get_frames.
+        crop: A tuple of four ints, x, y, width, and height, of a rectangle to crop to, see get_frames.
+        mask: An ndarray of bools, True where pixels are compared, or None to store whole frames.
+        method: A string representing the image similarity method the frames will be compared with,
+                see mask_frames.
+
+    Returns:
+        A list of ndarrays, or a SpilledFrames if spill_path is given,
+        containing at most number_of_frames_to_read frames from video, starting from frame number start.
+    """
+
+    import numpy as np
+    import cv2 as cv
+
+    out: Union[List[np.ndarray], SpilledFrames, None] = [] if spill_path is None else None
+    video.set(cv.CAP_PROP_POS_FRAMES, start)
+
+    read: int = 0
+    while read < number_of_frames_to_read:
+        block: List[np.ndarray] = get_frames(start + read, min(block_size, number_of_frames_to_read - read),
+                                             video, multichannel, downscale, verbose, seek=False, crop=crop)
+        if not block:
+            break
+
+        if mask is not None:
+            # Copy the masked frames, so the whole frames can be freed
+            block = [np.ascontiguousarray(frame) for frame in mask_frames(block, mask, method)[0]]
+
+        if out is None:
+            out = SpilledFrames(spill_path, block[0].shape)
+        for frame in block:
+            out.append(frame)
+
+        read += len(block)
+        if len(block) < block_size:
+            # End of video
+            break
+
+    if out is None:
+        return []
+    if isinstance(out, SpilledFrames):
+        out.close()
+    return out
+
+
+def get_frames_cached(path: str, start: int, number_of_frames_to_read: int, video: cv.VideoCapture,
+                      multichannel: bool = True, downscale: bool = False, verbose: int = 0,
+                      frame_cache: Union[FrameCache, None] = None,
+                      crop: Union[Tuple[int, int, int, int], None] = None) -> List[np.ndarray]:
+    """Gets frames from video, looking them up in frame_cache first.
+
+    Works like get_frames, but if frame_cache is given, frames already decoded
+    from the file at path are returned from the cache, and newly decoded frames are stored in it.
+
+    Args:
+        path: A string representing the path to the video file video was opened from.
+        start: An int representing the frame number to start from.
+        number_of_frames_to_read: An int representing the number of frames to read.
+        video: An open OpenCV video capture to read frames from.
+        multichannel: A bool for selecting to extract colour or greyscale frames.
+        downscale: A bool for selecting to downscale extracted frames to 480p.
+        verbose: An int controlling the printing of detailed information, see get_frames.
+                 If verbose >= 1 the function prints a notice when cached frames are used.
+        frame_cache: A FrameCache to look frames up in, or None to always decode.
+        crop: A tuple of four ints, x, y, width, and height, of a rectangle to crop to, see get_frames.
+
+    Returns:
+        A list of ndarrays, see get_frames. The frames may be shared with other callers,
+        and must not be modified.
+    """
+
+    if frame_cache is None:
+        return get_frames(start, number_of_frames_to_read, video, multichannel, downscale, verbose, crop=crop)
+
+    key: Union[Tuple, None] = frame_cache.make_key(path, start, number_of_frames_to_read, multichannel, downscale,
+                                                   crop)
+    frames: Union[List[np.ndarray], None] = frame_cache.get(key)
+    if frames is None:
+        frames = get_frames(start, number_of_frames_to_read, video, multichannel, downscale, verbose, crop=crop)
+        frame_cache.put(key, frames)
+    elif verbose >= 1:
+        print("Using", len(frames), "cached frames")
+
+    return frames
+
+
 def find_matching_frames(lead_vid_path: str, following_vids_paths: List[str], seconds: int,
                          multichannel: bool = True, downscale: bool = False,
-                         method: str = 'mse', verbose: int = 0) -> Union[List[Union[Tuple[int, int, float], None]], None]:
+                         method: str = 'mse', verbose: int = 0,
+                         max_memory: Union[int, None] = None,
+                         cache: bool = False,
+                         frame_cache: Union[FrameCache, None] = None, audio: bool = False,
+                         audio_band: float = 0.5, crop: Union[Tuple[int, int, int, int], None] = None,
+                         mask: Union[str, np.ndarray, None] = None) -> Union[List[Union[Tuple[int, int, float], None]], None]:
     """Finds the most similar frames in two videos.
 
     Searches the frames in the last seconds of the lead video
@@ -160,6 +402,24 @@ def find_matching_frames(lead_vid_path: str, following_vids_paths: List[str], se
                  verbose >= 1 prints stage of operation,
                  verbose >= 2 prints threading and time,
                  verbose >= 3 prints detailed processing.
+        max_memory: An int representing a memory budget in megabytes, or None for no budget.
+                    If given, frames are decoded and compared in tiles that fit in the budget,
+                    spilling frames that don't fit to scratch files on disk,
+                    see find_matching_frames_within_budget.
+        cache: A bool for selecting to use the persistent result cache, see result_cache.ResultCache.
+               Results found in the cache are returned without searching,
+               and new results are stored in the cache.
+        frame_cache: A FrameCache of decoded frames shared between searches, or None.
+                     Not used when max_memory is given.
+        audio: A bool for selecting to align the videos by their audio first, using a local ffmpeg,
+               and only search the frame pairs within audio_band seconds of the audio offset.
+               Falls back to searching all frame pairs if there is no audio or it doesn't match.
+               Not used when max_memory is given.
+        audio_band: A float representing how far from the audio offset to search, in seconds.
+        crop: A tuple of four ints, x, y, width, and height, of a rectangle in the original frames
+              to search in, or None to search whole frames. Frames are cropped while decoding.
+        mask: A string representing a path to an image, or an ndarray, the size of the original frames,
+              where non-zero pixels are ignored, or None to compare every pixel. See load_mask.
 
     Returns:
         A list of int, int, float tuples or Nones, where each tuple or None is the result of
@@ -167,8 +427,58 @@ def find_matching_frames(lead_vid_path: str, following_vids_paths: List[str], se
         where the ints are the found frames and the float the similarity score,
         and a None means a following video could not be opened.
         Or None if the leading video could not be opened.
+
+    Notes:
+        Unless max_memory is given, the leading and following videos are decoded concurrently
+        by NUMBER_OF_DECODERS threads, and each following video is searched as soon as its frames
+        are decoded. At most DECODED_QUEUE_SIZE decoded following videos wait for the search at a time.
     """
 
+    if cache:
+        cache_start: float = time.time()
+        result_cache: ResultCache = ResultCache()
+        # Options that change the result are part of the key
+        cache_options: Dict[str, Any] = {}
+        if audio:
+            cache_options["audio_band"] = audio_band
+        if crop is not None:
+            cache_options["crop"] = list(crop)
+        if isinstance(mask, str):
+            # Masks are keyed by content, like videos
+            cache_options["mask"] = result_cache.fingerprint(mask)
+        elif mask is not None:
+            cache_options["mask"] = hashlib.blake2b(repr(mask.shape).encode() + mask.tobytes()).hexdigest()
+        cached: List[Union[Tuple[int, int, float], None]] = [
+            result_cache.get(lead_vid_path, path, seconds, multichannel, downscale, method, cache_options)
+            for path in following_vids_paths]
+        result_cache.flush_stats()
+        missing_paths: List[str] = [path for path, result in zip(following_vids_paths, cached) if result is None]
+
+        if verbose >= 1:
+            print("Found", len(following_vids_paths) - len(missing_paths), "of", len(following_vids_paths),
+                  "results in cache")
+
+        if missing_paths:
+            found: Union[List[Union[Tuple[int, int, float], None]], None] = find_matching_frames(
+                lead_vid_path, missing_paths, seconds, multichannel, downscale, method, verbose, max_memory,
+                frame_cache=frame_cache, audio=audio, audio_band=audio_band, crop=crop, mask=mask)
+            if found is None:
+                return None
+
+            found_by_path: Dict[str, Union[Tuple[int, int, float], None]] = dict(zip(missing_paths, found))
+            for path, result in found_by_path.items():
+                if result is not None:
+                    result_cache.put(lead_vid_path, path, seconds, multichannel, downscale, method, result,
+                                     cache_options)
+            cached = [found_by_path[path] if result is None else result
+                      for path, result in zip(following_vids_paths, cached)]
+        elif verbose >= 2:
+            print('Time elapsed:', str(datetime.timedelta(seconds=(time.time() - cache_start))))
+
+        return cached
+
+    import cv2 as cv
+
     if verbose >= 1:
         arg_message = "Processing " + str(seconds) + " seconds. Using " + method.upper()
 
@@ -195,49 +505,313 @@ def find_matching_frames(lead_vid_path: str, following_vids_paths: List[str], se
         return None
 
     number_of_frames: int = int(capture.get(cv.CAP_PROP_FRAME_COUNT))
-    fps: int = int(capture.get(cv.CAP_PROP_FPS))
+    # Read before the capture is handed to a decoder thread, captures are not thread-safe
+    lead_fps: float = capture.get(cv.CAP_PROP_FPS)
+    fps: int = int(lead_fps)
     number_of_frames_to_read: int = fps * seconds
     lead_vid_start: int = number_of_frames - number_of_frames_to_read - 1
 
+    if crop is not None:
+        crop = get_crop_box(capture, crop)
+        if crop is None:
+            print("Error, the crop rectangle is outside the frames of", lead_vid_path)
+            capture.release()
+            return None
+
+    # Check the size before decoding, a crop can become too small to compare once downscaled
+    frame_shape: Tuple[int, ...] = get_frame_shape(capture, multichannel, downscale, crop)
+    minimum_size: int = SSIM_WINDOW_SIZE if method == 'ssim' else 1
+    if min(frame_shape[:2]) < minimum_size:
+        print("Error, the frames to compare are", frame_shape[1], "by", frame_shape[0], "pixels,",
+              method, "needs at least", minimum_size, "by", minimum_size, "pixels")
+        print("Use a larger crop rectangle, --no-downscale, or another method.")
+        capture.release()
+        return None
+
+    if mask is not None:
+        mask = load_mask(mask, capture, crop, frame_shape)
+        if mask is None:
+            capture.release()
+            return None
+
+    if max_memory is not None:
+        out: List[Union[Tuple[int, int, float], None]] = find_matching_frames_within_budget(
+            capture, lead_vid_start, number_of_frames_to_read, following_vids_paths, seconds,
+            multichannel, downscale, method, max_memory, verbose, crop, mask)
+        capture.release()
+
+        end: float = time.time()
+        if verbose >= 2:
+            print('Time elapsed:', str(datetime.timedelta(seconds=(end - start))))
+
+        return out
+
     if verbose >= 1:
         print("Getting", number_of_frames_to_read, "leading frames...")
 
-    lead_vid: List[np.ndarray] = get_frames(lead_vid_start, number_of_frames_to_read, capture, multichannel, downscale, verbose)
+    # Decode the leading and following videos concurrently, and search each following video
+    # as soon as its frames are decoded, while the next ones are still being decoded.
+    # The queue is bounded, so decoders wait for the search instead of piling up decoded frames.
+    decoded: queue.Queue = queue.Queue(maxsize=DECODED_QUEUE_SIZE)
+
+    def decode_following_vid(index: int, path: str) -> None:
+        try:
+            decoded.put((index, get_following_frames(path, seconds, multichannel, downscale, verbose,
+                                                     frame_cache, audio, crop), None))
+        except Exception as exception:
+            decoded.put((index, ([], 0.0, None), exception))
+
+    out: List[Union[Tuple[int, int, float], None]] = [None] * len(following_vids_paths)
+    received: int = 0
+    with ThreadPoolExecutor(max_workers=NUMBER_OF_DECODERS) as decoders:
+        # Submitted first, so a decoder is never blocked on the queue while the leading frames are pending
+        lead_future: Future = decoders.submit(get_frames_cached, lead_vid_path, lead_vid_start,
+                                              number_of_frames_to_read, capture, multichannel, downscale,
+                                              verbose, frame_cache, crop)
+        if audio:
+            lead_envelope_future: Future = decoders.submit(get_audio_envelope, lead_vid_path, lead_vid_start / lead_fps,
+                                                           number_of_frames_to_read / lead_fps)
+        for index, path in enumerate(following_vids_paths):
+            decoders.submit(decode_following_vid, index, path)
+
+        try:
+            lead_vid: List[np.ndarray] = lead_future.result()
+            if audio:
+                lead_envelope: Union[np.ndarray, None] = lead_envelope_future.result()
+
+            # Calculate most similar frames
+            while received < len(following_vids_paths):
+                index, (following_vid, following_fps, following_envelope), exception = decoded.get()
+                received += 1
+                if exception is not None:
+                    raise exception
+
+                if following_vid:
+                    band: Union[Tuple[float, float, int], None] = None
+                    if audio:
+                        band = get_audio_band(lead_envelope, following_envelope, lead_fps, following_fps,
+                                              audio_band, verbose)
+                        if band is not None and not any(get_following_indices(i, len(following_vid), band)
+                                                        for i in range(len(lead_vid))):
+                            if verbose >= 1:
+                                print("Audio offset is outside the searched frames, searching all frame pairs")
+                            band = None
+
+                    most_similar_frames: Tuple[int, int, float] = get_most_similar_frames(lead_vid, following_vid,
+                                                                                          lead_vid_start, multichannel,
+                                                                                          method, verbose, band=band,
+                                                                                          mask=mask)
+                    if band is not None and not is_band_consistent(lead_vid, following_vid, lead_vid_start,
+                                                                   most_similar_frames, band, multichannel,
+                                                                   method, mask):
+                        if verbose >= 1:
+                            print("Frames outside the audio band match better, searching all frame pairs")
+                        most_similar_frames = get_most_similar_frames(lead_vid, following_vid, lead_vid_start,
+                                                                      multichannel, method, verbose, mask=mask)
+                    out[index] = most_similar_frames
+        finally:
+            capture.release()
+            # Unblock the remaining decoders if the search failed, so they can finish
+            while received < len(following_vids_paths):
+                decoded.get()
+                received += 1
+
+    end: float = time.time()
+    if verbose >= 2:
+        print('Time elapsed:', str(datetime.timedelta(seconds=(end - start))))
+
+    return out
+
+
+def get_following_frames(path: str, seconds: int, multichannel: bool = True, downscale: bool = False,
+                         verbose: int = 0, frame_cache: Union[FrameCache, None] = None, audio: bool = False,
+                         crop: Union[Tuple[int, int, int, int], None] = None
+                         ) -> Tuple[List[np.ndarray], float, Union[np.ndarray, None]]:
+    """Gets the frames, and optionally the audio envelope, in the first seconds of the video at path.
+
+    Args:
+        path: A string representing a path to the following video file.
+        seconds: An int representing the number of seconds to get.
+        multichannel: A bool for selecting to extract colour or greyscale frames.
+        downscale: A bool for selecting to downscale extracted frames to 480p.
+        verbose: An int controlling the printing of detailed information, see get_frames.
+        frame_cache: A FrameCache to look frames up in, or None to always decode.
+        audio: A bool for selecting to get the audio envelope, see audio_prefilter.get_audio_envelope.
+        crop: A tuple of four ints, x, y, width, and height, of a rectangle to crop to, see get_frames.
+
+    Returns:
+        A tuple of a list of ndarrays, see get_frames, the frame rate of the video as a float,
+        and the audio envelope or None if audio is False or the video has no audio.
+        The list is empty if the video could not be opened.
+    """
+
+    import cv2 as cv
+
+    capture: cv.VideoCapture = cv.VideoCapture(path)
+
+    if not capture.isOpened():
+        print("Error opening video file at", path)
+        print("Make sure it exists, is a valid video file, and appropriate codecs are installed.")
+        return [], 0.0, None
+
+    fps: int = int(capture.get(cv.CAP_PROP_FPS))
+    number_of_frames_to_read: int = fps * seconds
+
+    if verbose >= 1:
+        print("Getting", number_of_frames_to_read, "following frames...")
+
+    following_vid: List[np.ndarray] = get_frames_cached(path, 0, number_of_frames_to_read, capture,
+                                                        multichannel, downscale, verbose, frame_cache, crop)
+    exact_fps: float = capture.get(cv.CAP_PROP_FPS)
     capture.release()
 
-    # Get following videos
-    following_vids: List[List[np.ndarray]] = []
-    for path in following_vids_paths:
-        capture: cv.VideoCapture = cv.VideoCapture(path)
+    envelope: Union[np.ndarray, None] = get_audio_envelope(path, 0.0, number_of_frames_to_read / exact_fps) if audio else None
+    return following_vid, exact_fps, envelope
+
+
+def find_matching_frames_within_budget(lead_capture: cv.VideoCapture, lead_vid_start: int,
+                                       number_of_frames_to_read: int, following_vids_paths: List[str],
+                                       seconds: int, multichannel: bool = True, downscale: bool = False,
+                                       method: str = 'mse', max_memory: int = 1024, verbose: int = 0,
+                                       crop: Union[Tuple[int, int, int, int], None] = None,
+                                       mask: Union[np.ndarray, None] = None) -> List[Union[Tuple[int, int, float], None]]:
+    """Finds the most similar frames in two videos, using at most max_memory megabytes.
+
+    Decodes the frames a block at a time, keeping a stack of frames in memory
+    if it fits in the budget, and spilling it to a scratch file if not.
+    The following videos are decoded and searched one at a time, and each search is split
+    into tiles of the grid of frame pairs, see memory_budget.plan_tiles.
+    Part of the budget is set aside for the working memory of the similarity method,
+    which limits the number of threads used.
+
+    Args:
+        lead_capture: An open OpenCV video capture of the leading video.
+        lead_vid_start: An int representing the frame number to start reading the leading video from.
+        number_of_frames_to_read: An int representing the number of leading frames to read.
+        following_vids_paths: A list of stings representing paths to the following video files.
+        seconds: An int representing the number of seconds to search.
+        multichannel: A bool for selecting to extract colour or greyscale frames.
+        downscale: A bool for selecting to downscale extracted frames to 480p.
+        method: A sting representing the image similarity method to use, see find_matching_frames.
+        max_memory: An int representing the memory budget in megabytes.
+        verbose: An int controlling the printing of detailed information, see find_matching_frames.
+                 If verbose >= 2 the planned tiles and the peak memory usage are printed.
+        crop: A tuple of four ints, x, y, width, and height, of a rectangle to crop to, see get_frames.
+        mask: An ndarray of bools, True where pixels are compared, or None, see get_most_similar_frames.
+              It's applied while decoding, so the memory budget covers only the compared pixels.
+
+    Returns:
+        A list of int, int, float tuples or Nones, see find_matching_frames.
+
+    Notes:
+        The working memory of the similarity methods is estimated, so the peak memory usage
+        can exceed the budget slightly. If the budget is too small to hold even a single
+        pair of frames the search still runs, one pair at a time, and a notice is printed.
+    """
+
+    import numpy as np
+    import cv2 as cv
+
+    # Only count memory used from here on, so import everything the search needs first
+    import_dependencies()
+    budget: int = max_memory * MEGABYTE - get_memory_usage()
+
+    lead_frame_shape: Tuple[int, ...] = get_frame_shape(lead_capture, multichannel, downscale, crop)
+    # Masks are applied while decoding, so the stacks and tiles only hold the compared pixels,
+    # and the search only needs what's left of the mask, if anything
+    tile_mask: Union[np.ndarray, None] = None
+    if mask is not None:
+        lead_frame_shape = get_masked_frame_shape(lead_frame_shape, mask, method)
+        tile_mask = mask_frames([], mask, method)[1]
+    lead_frame_bytes: int = int(np.prod(lead_frame_shape))
+    full_frame_bytes: int = int(np.prod(get_frame_shape(lead_capture, multichannel, False, crop)))
+
+    # Try to set number of jobs to the number of available CPUs.
+    # If os.cpu_count() failed and returned None,
+    # default to 4 jobs, as that's good enough.
+    number_of_jobs: int = os.cpu_count()
+    if not number_of_jobs:
+        number_of_jobs = 4
+
+    # Use at most half of the budget as working memory, running fewer threads if need be
+    working_memory_per_job: int = lead_frame_bytes * WORKING_MEMORY_FACTORS.get(method, WORKING_MEMORY_FACTORS['mse'])
+    number_of_jobs = max(1, min(number_of_jobs, (budget // 2) // working_memory_per_job))
+    working_memory: int = number_of_jobs * working_memory_per_job
+    frame_budget: int = budget - working_memory
+
+    # Decoding holds a block of full resolution frames, and resizing converts them to float64
+    decode_block_size: int = max(1, working_memory // (full_frame_bytes * 9))
+
+    if frame_budget < 2 * lead_frame_bytes and verbose >= 1:
+        print("Memory budget of", max_memory, "MB is too small, comparing one pair of frames at a time")
+
+    with tempfile.TemporaryDirectory(prefix="automerge-") as scratch_dir:
+        lead_in_memory: bool = number_of_frames_to_read * lead_frame_bytes <= frame_budget // 2
+        if verbose >= 1:
+            print("Getting", number_of_frames_to_read, "leading frames...")
+
+        lead_vid: Union[List[np.ndarray], SpilledFrames] = get_frames_in_blocks(
+            lead_vid_start, number_of_frames_to_read, lead_capture, decode_block_size,
+            None if lead_in_memory else os.path.join(scratch_dir, "lead.bin"), multichannel, downscale, verbose,
+            crop, mask, method)
+
+        out: List[Union[Tuple[int, int, float], None]] = []
+        for index, path in enumerate(following_vids_paths):
+            capture: cv.VideoCapture = cv.VideoCapture(path)
+
+            if not capture.isOpened():
+                print("Error opening video file at", path)
+                print("Make sure it exists, is a valid video file, and appropriate codecs are installed.")
+                out.append(None)
+                continue
 
-        if not capture.isOpened():
-            print("Error opening video file at", path)
-            print("Make sure it exists, is a valid video file, and appropriate codecs are installed.")
-            following_vids.append([])
-        else:
             fps: int = int(capture.get(cv.CAP_PROP_FPS))
-            number_of_frames_to_read: int = fps * seconds
+            number_of_following_frames: int = fps * seconds
+            following_frame_shape: Tuple[int, ...] = get_frame_shape(capture, multichannel, downscale, crop)
+            if mask is not None:
+                following_frame_shape = get_masked_frame_shape(following_frame_shape, mask, method)
+            following_frame_bytes: int = int(np.prod(following_frame_shape))
+
+            # Keep the following frames in memory if there is room left for at least one leading frame
+            room_left: int = frame_budget - (len(lead_vid) * lead_frame_bytes if lead_in_memory else lead_frame_bytes)
+            following_in_memory: bool = number_of_following_frames * following_frame_bytes <= room_left
 
             if verbose >= 1:
-                print("Getting", number_of_frames_to_read, "following frames...")
+                print("Getting", number_of_following_frames, "following frames...")
 
-            following_vids.append(get_frames(0, number_of_frames_to_read, capture, multichannel, downscale, verbose))
+            following_vid: Union[List[np.ndarray], SpilledFrames] = get_frames_in_blocks(
+                0, number_of_following_frames, capture, decode_block_size,
+                None if following_in_memory else os.path.join(scratch_dir, "following" + str(index) + ".bin"),
+                multichannel, downscale, verbose, crop, mask, method)
             capture.release()
 
-    # Calculate most similar frames
-    out: List[Tuple[int, int, float]] = []
-    for following_vid in following_vids:
-        if following_vid:
-            most_similar_frames: Tuple[int, int, float] = get_most_similar_frames(lead_vid, following_vid,
-                                                                                  lead_vid_start, multichannel,
-                                                                                  method, verbose)
-            out.append(most_similar_frames)
-        else:
-            out.append(None)
+            if not following_vid or not lead_vid:
+                out.append(None)
+                continue
+
+            lead_block, following_block = plan_tiles(len(lead_vid), lead_frame_bytes,
+                                                     len(following_vid), following_frame_bytes,
+                                                     frame_budget, lead_in_memory, following_in_memory)
+            if verbose >= 2:
+                print("Searching in tiles of", lead_block, "leading and", following_block, "following frames,",
+                      "using", number_of_jobs, "threads...")
+
+            out.append(get_most_similar_frames_tiled(lead_vid, following_vid, lead_vid_start,
+                                                     lead_block, following_block, multichannel,
+                                                     method, verbose, number_of_jobs, tile_mask))
+
+            # Free the following frames before decoding the next video
+            del following_vid
+            spill_path: str = os.path.join(scratch_dir, "following" + str(index) + ".bin")
+            if os.path.exists(spill_path):
+                os.remove(spill_path)
+
+        del lead_vid
 
-    end: float = time.time()
     if verbose >= 2:
-        print('Time elapsed:', str(datetime.timedelta(seconds=(end - start))))
+        peak_memory_usage: int = get_peak_memory_usage()
+        if peak_memory_usage:
+            print("Peak memory usage:", peak_memory_usage // MEGABYTE, "MB of", max_memory, "MB budget")
 
     return out
 
@@ -245,6 +819,7 @@ def find_matching_frames(lead_vid_path: str, following_vids_paths: List[str], se
 # Wrapper for skimage.measure.compare_mse().
 def run_mse(lead_frame: np.ndarray, following_frame: np.ndarray,
             lead_frame_number: int, following_frame_number: int) -> Tuple[int, int, float]:
+    from skimage.measure import compare_mse
     score: float = compare_mse(lead_frame, following_frame)
     return lead_frame_number, following_frame_number, score
 
@@ -252,6 +827,7 @@ def run_mse(lead_frame: np.ndarray, following_frame: np.ndarray,
 # Wrapper for skimage.measure.compare_nrmse().
 def run_nrmse(lead_frame: np.ndarray, following_frame: np.ndarray,
               lead_frame_number: int, following_frame_number: int) -> Tuple[int, int, float]:
+    from skimage.measure import compare_nrmse
     score: float = compare_nrmse(lead_frame, following_frame, norm_type="min-max")
     return lead_frame_number, following_frame_number, score
 
@@ -259,22 +835,129 @@ def run_nrmse(lead_frame: np.ndarray, following_frame: np.ndarray,
 # Wrapper for skimage.measure.compare_psnr().
 def run_psnr(lead_frame: np.ndarray, following_frame: np.ndarray,
              lead_frame_number: int, following_frame_number: int) -> Tuple[int, int, float]:
+    from skimage.measure import compare_psnr
     score: float = compare_psnr(lead_frame, following_frame)
     return lead_frame_number, following_frame_number, score
 
 
 # Wrapper for skimage.measure.compare_ssim().
+# If mask is given, the SSIM map is averaged over the pixels where mask is True.
 def run_ssim(lead_frame: np.ndarray, following_frame: np.ndarray,
-             lead_frame_number: int, following_frame_number: int, multichannel: bool = True) -> Tuple[int, int, float]:
-    score: float = compare_ssim(lead_frame, following_frame, multichannel=multichannel,
-                                # Set arguments to match the implementation of Wang et. al.
-                                gaussian_weights=True, use_sample_covariance=False, sigma=1.5)
+             lead_frame_number: int, following_frame_number: int, multichannel: bool = True,
+             mask: Union[np.ndarray, None] = None) -> Tuple[int, int, float]:
+    from skimage.measure import compare_ssim
+    if mask is None:
+        score: float = compare_ssim(lead_frame, following_frame, multichannel=multichannel,
+                                    # Set arguments to match the implementation of Wang et. al.
+                                    gaussian_weights=True, use_sample_covariance=False, sigma=1.5)
+    else:
+        _, ssim_map = compare_ssim(lead_frame, following_frame, multichannel=multichannel, full=True,
+                                   # Set arguments to match the implementation of Wang et. al.
+                                   gaussian_weights=True, use_sample_covariance=False, sigma=1.5)
+        score = float(ssim_map[mask].mean())
     return lead_frame_number, following_frame_number, score
 
 
+def load_mask(mask: Union[str, np.ndarray], video: cv.VideoCapture,
+              crop: Union[Tuple[int, int, int, int], None], frame_shape: Tuple[int, ...]) -> Union[np.ndarray, None]:
+    """Loads an ignore mask and fits it to the frames get_frames returns.
+
+    Args:
+        mask: A string representing a path to an image, or an ndarray, the size of the original frames,
+              where non-zero pixels are ignored. It's stretched to the size of the frames if it's not.
+        video: An open OpenCV video capture the frames are read from.
+        crop: A tuple of four ints, x, y, width, and height, of the rectangle the frames are cropped to, or None.
+        frame_shape: A tuple of ints representing the shape of the frames, see get_frame_shape.
+
+    Returns:
+        An ndarray of bools with the height and width of the frames, True where pixels are compared.
+        Or None if the mask could not be read, or ignores every pixel, in which case an error is printed.
+    """
+
+    import numpy as np
+    import cv2 as cv
+
+    if isinstance(mask, str):
+        image: Union[np.ndarray, None] = cv.imread(mask, cv.IMREAD_GRAYSCALE)
+        if image is None:
+            print("Error opening mask at", mask)
+            print("Make sure it exists and is a valid image file.")
+            return None
+    else:
+        image = np.asarray(mask)
+        if image.ndim == 3:
+            image = image.max(axis=2)
+
+    ignored: np.ndarray = (image != 0).astype(np.uint8)
+    frame_height: int = int(video.get(cv.CAP_PROP_FRAME_HEIGHT))
+    frame_width: int = int(video.get(cv.CAP_PROP_FRAME_WIDTH))
+    if ignored.shape != (frame_height, frame_width):
+        ignored = cv.resize(ignored, (frame_width, frame_height), interpolation=cv.INTER_NEAREST)
+    if crop is not None:
+        x, y, width, height = crop
+        ignored = ignored[y:y + height, x:x + width]
+    ignored = cv.resize(ignored, (frame_shape[1], frame_shape[0]), interpolation=cv.INTER_NEAREST)
+
+    compared: np.ndarray = ignored == 0
+    if not compared.any():
+        print("Error, the mask ignores every pixel")
+        return None
+    return compared
+
+
+def mask_frames(frames: Sequence[np.ndarray], mask: np.ndarray,
+                method: str = 'mse') -> Tuple[List[np.ndarray], Union[np.ndarray, None]]:
+    """Reduces frames to the pixels compared by a similarity method.
+
+    For MSE, NRMSE, and PSNR, which compare pixels independently, each frame is reduced
+    to an array of only the compared pixels, so the cost of comparing is proportional to their number.
+    SSIM compares neighbourhoods of pixels, so the frames are cropped to the bounding box
+    of the compared pixels, grown to at least SSIM_WINDOW_SIZE pixels in each direction where the frames
+    are large enough, and the mask is returned to average the SSIM map with.
+
+    Args:
+        frames: A sequence of ndarrays representing frames.
+        mask: An ndarray of bools with the height and width of the frames, True where pixels are compared.
+        method: A string representing the image similarity method that will be used.
+
+    Returns:
+        A tuple of a list of the reduced frames, and the mask to pass to run_ssim,
+        or None if the mask has already been applied.
+    """
+
+    import numpy as np
+
+    if method != 'ssim':
+        return [frame[mask] for frame in frames], None
+
+    # Grows start:end to at least the SSIM window, keeping it centred and within 0:length
+    def grow(start: int, end: int, length: int) -> Tuple[int, int]:
+        size: int = min(max(end - start, SSIM_WINDOW_SIZE), length)
+        start = min(max(0, start - (size - (end - start)) // 2), length - size)
+        return start, start + size
+
+    rows: np.ndarray = np.flatnonzero(mask.any(axis=1))
+    columns: np.ndarray = np.flatnonzero(mask.any(axis=0))
+    top, bottom = grow(int(rows[0]), int(rows[-1]) + 1, mask.shape[0])
+    left, right = grow(int(columns[0]), int(columns[-1]) + 1, mask.shape[1])
+    return [frame[top:bottom, left:right] for frame in frames], mask[top:bottom, left:right]
+
+
+def get_masked_frame_shape(frame_shape: Tuple[int, ...], mask: np.ndarray, method: str = 'mse') -> Tuple[int, ...]:
+    """Gets the shape frames of frame_shape are reduced to by mask_frames."""
+
+    import numpy as np
+
+    masked_frames, _ = mask_frames([np.zeros(frame_shape, dtype=np.uint8)], mask, method)
+    return masked_frames[0].shape
+
+
 def get_most_similar_frames(lead_vid: List[np.ndarray], following_vid: List[np.ndarray],
                             offset: int, multichannel: bool = True, method: str = 'mse',
-                            verbose: int = 0) -> (int, int, float):
+                            verbose: int = 0, following_offset: int = 0,
+                            number_of_jobs: Union[int, None] = None,
+                            band: Union[Tuple[float, float, int], None] = None,
+                            mask: Union[np.ndarray, None] = None) -> (int, int, float):
     """Gets the most similar frames from two lists of frames.
 
     Searches lead_vid and following_vid for the most similar frames
@@ -297,16 +980,33 @@ def get_most_similar_frames(lead_vid: List[np.ndarray], following_vid: List[np.n
                  verbose <= 1 prints nothing,
                  verbose >= 2 prints how many frames are being processed and how many thread used,
                  verbose >= 3 prints which out of how many frames are being processed.
+        following_offset: An int representing the offset of the following frames in the following video,
+                          used to return the correct frame number for the following video.
+        number_of_jobs: An int representing the number of threads to use,
+                        or None to use as many as there are available CPUs.
+        band: A tuple of a float slope, a float intercept, and an int half width,
+              restricting the search to the frame pairs i, j where j is within half width
+              of slope * i + intercept, or None to search all frame pairs.
+              See audio_prefilter.get_audio_band.
+        mask: An ndarray of bools with the height and width of the frames, True where pixels are compared,
+              or None to compare whole frames. See load_mask and mask_frames.
 
     Returns:
         An tuple with two ints representing the frame numbers of the two most similar frames,
         and a  float representing the similarity score.
     """
 
+    from joblib import Parallel, delayed
+
+    if mask is not None:
+        lead_vid, _ = mask_frames(lead_vid, mask, method)
+        following_vid, mask = mask_frames(following_vid, mask, method)
+
     # Try to set number of jobs to the number of available CPUs.
     # If os.cpu_count() failed and returned None,
     # default to 4 jobs, as that's good enough.
-    number_of_jobs: int = os.cpu_count()
+    if not number_of_jobs:
+        number_of_jobs = os.cpu_count()
     if not number_of_jobs:
         number_of_jobs = 4
 
@@ -319,8 +1019,10 @@ def get_most_similar_frames(lead_vid: List[np.ndarray], following_vid: List[np.n
             for i, lead_frame in enumerate(lead_vid):
                 if verbose >= 3:
                     print("Processing frame", i + 1, "of", len(lead_vid))
-                diff_list: List[Tuple[int, int, float]] = (parallel(delayed(run_mse)(lead_frame, following_frame, i + offset, j)
-                                                                    for j, following_frame in enumerate(following_vid)))
+                diff_list: List[Tuple[int, int, float]] = (parallel(delayed(run_mse)(lead_frame, following_vid[j], i + offset, j + following_offset)
+                                                                    for j in get_following_indices(i, len(following_vid), band)))
+                if not diff_list:
+                    continue
                 diff: Tuple[int, int, float] = min(diff_list, key=lambda diff_tuple: diff_tuple[2])
                 if diff[2] < min_diff[2]:
                     min_diff = diff
@@ -333,8 +1035,10 @@ def get_most_similar_frames(lead_vid: List[np.ndarray], following_vid: List[np.n
             for i, lead_frame in enumerate(lead_vid):
                 if verbose >= 3:
                     print("Processing frame", i + 1, "of", len(lead_vid))
-                diff_list: List[Tuple[int, int, float]] = (parallel(delayed(run_nrmse)(lead_frame, following_frame, i + offset, j)
-                                                                    for j, following_frame in enumerate(following_vid)))
+                diff_list: List[Tuple[int, int, float]] = (parallel(delayed(run_nrmse)(lead_frame, following_vid[j], i + offset, j + following_offset)
+                                                                    for j in get_following_indices(i, len(following_vid), band)))
+                if not diff_list:
+                    continue
                 diff: Tuple[int, int, float] = min(diff_list, key=lambda diff_tuple: diff_tuple[2])
                 if diff[2] < min_diff[2]:
                     min_diff = diff
@@ -347,8 +1051,10 @@ def get_most_similar_frames(lead_vid: List[np.ndarray], following_vid: List[np.n
             for i, lead_frame in enumerate(lead_vid):
                 if verbose >= 3:
                     print("Processing frame", i + 1, "of", len(lead_vid))
-                diff_list: List[Tuple[int, int, float]] = (parallel(delayed(run_psnr)(lead_frame, following_frame, i + offset, j)
-                                                                    for j, following_frame in enumerate(following_vid)))
+                diff_list: List[Tuple[int, int, float]] = (parallel(delayed(run_psnr)(lead_frame, following_vid[j], i + offset, j + following_offset)
+                                                                    for j in get_following_indices(i, len(following_vid), band)))
+                if not diff_list:
+                    continue
                 diff: Tuple[int, int, float] = max(diff_list, key=lambda diff_tuple: diff_tuple[2])
                 if diff[2] > min_diff[2]:
                     min_diff = diff
@@ -361,8 +1067,10 @@ def get_most_similar_frames(lead_vid: List[np.ndarray], following_vid: List[np.n
             for i, lead_frame in enumerate(lead_vid):
                 if verbose >= 3:
                     print("Processing frame", i + 1, "of", len(lead_vid))
-                diff_list: List[Tuple[int, int, float]] = (parallel(delayed(run_ssim)(lead_frame, following_frame, i + offset, j, multichannel=multichannel)
-                                                                    for j, following_frame in enumerate(following_vid)))
+                diff_list: List[Tuple[int, int, float]] = (parallel(delayed(run_ssim)(lead_frame, following_vid[j], i + offset, j + following_offset, multichannel=multichannel, mask=mask)
+                                                                    for j in get_following_indices(i, len(following_vid), band)))
+                if not diff_list:
+                    continue
                 diff: Tuple[int, int, float] = max(diff_list, key=lambda diff_tuple: diff_tuple[2])
                 if diff[2] > min_diff[2]:
                     min_diff = diff
@@ -371,7 +1079,162 @@ def get_most_similar_frames(lead_vid: List[np.ndarray], following_vid: List[np.n
 
     else:
         print("Invalid method, defaulting to MSE")
-        return get_most_similar_frames(lead_vid, following_vid, offset, multichannel, 'mse')
+        return get_most_similar_frames(lead_vid, following_vid, offset, multichannel, 'mse',
+                                       verbose, following_offset, number_of_jobs, band, mask)
+
+
+def get_following_indices(lead_index: int, number_of_following_frames: int,
+                          band: Union[Tuple[float, float, int], None] = None) -> range:
+    """Gets the indices of the following frames to compare to a leading frame.
+
+    Args:
+        lead_index: An int representing the index of the leading frame.
+        number_of_following_frames: An int representing the number of following frames.
+        band: A tuple of a float slope, a float intercept, and an int half width, see get_most_similar_frames,
+              or None for all following frames.
+
+    Returns:
+        A range of indices of following frames.
+    """
+
+    if band is None:
+        return range(number_of_following_frames)
+
+    slope, intercept, half_width = band
+    centre: int = int(round(slope * lead_index + intercept))
+    return range(max(0, centre - half_width), min(number_of_following_frames, centre + half_width + 1))
+
+
+def is_band_consistent(lead_vid: List[np.ndarray], following_vid: List[np.ndarray], offset: int,
+                       best: Tuple[int, int, float], band: Tuple[float, float, int], multichannel: bool = True,
+                       method: str = 'mse', mask: Union[np.ndarray, None] = None) -> bool:
+    """Checks that no sampled frame pair outside a band is a better match than the best pair inside it.
+
+    A cheap guard against a wrong audio offset. BAND_CHECK_FRAMES leading frames, spread evenly,
+    are compared to every half width-th following frame outside the band, so every offset
+    outside the band is sampled at about the width of the band.
+
+    Args:
+        lead_vid: A list of ndarrays representing frames from the leading video.
+        following_vid: A list of ndarrays representing frames from the following video.
+        offset: An int representing the offset of the leading frames in the leading video.
+        best: A tuple of two frame numbers and a similarity score, the best match inside the band.
+        band: A tuple of a float slope, a float intercept, and an int half width, see get_most_similar_frames.
+        multichannel: A bool specifying if the frames are in colour or greyscale.
+        method: A string representing the image similarity method best was found with.
+        mask: An ndarray of bools, True where pixels are compared, or None, see get_most_similar_frames.
+
+    Returns:
+        True if no sampled pair outside the band is more similar than best, else False.
+    """
+
+    import numpy as np
+
+    stride: int = max(1, band[2])
+    lead_indices: List[int] = sorted(set(int(round(index)) for index in
+                                         np.linspace(0, len(lead_vid) - 1, min(BAND_CHECK_FRAMES, len(lead_vid)))))
+    for i in lead_indices:
+        in_band: range = get_following_indices(i, len(following_vid), band)
+        sampled: List[int] = [j for j in range(0, len(following_vid), stride) if j not in in_band]
+        if not sampled:
+            continue
+
+        found: Tuple[int, int, float] = get_most_similar_frames([lead_vid[i]], [following_vid[j] for j in sampled],
+                                                                offset + i, multichannel, method, mask=mask)
+        if is_more_similar((found[0], sampled[found[1]], found[2]), best, method):
+            return False
+
+    return True
+
+
+def is_more_similar(candidate: Tuple[int, int, float], best: Tuple[int, int, float], method: str = 'mse') -> bool:
+    """Checks if candidate is a better match than best according to method.
+
+    Lower scores are better for MSE and NRMSE, higher scores are better for PSNR and SSIM.
+    Ties are broken by the lowest frame numbers, the same way get_most_similar_frames does.
+
+    Args:
+        candidate: A tuple of two frame numbers and a similarity score.
+        best: A tuple of two frame numbers and a similarity score.
+        method: A sting representing the image similarity method the scores were calculated with.
+
+    Returns:
+        True if candidate is a better match than best, else False.
+    """
+
+    if candidate[2] == best[2]:
+        return candidate[:2] < best[:2]
+    if method in ['psnr', 'ssim']:
+        return candidate[2] > best[2]
+    return candidate[2] < best[2]
+
+
+def get_most_similar_frames_tiled(lead_vid: Sequence[np.ndarray], following_vid: Sequence[np.ndarray],
+                                  offset: int, lead_block: int, following_block: int,
+                                  multichannel: bool = True, method: str = 'mse', verbose: int = 0,
+                                  number_of_jobs: Union[int, None] = None,
+                                  mask: Union[np.ndarray, None] = None) -> (int, int, float):
+    """Gets the most similar frames from two stacks of frames, one tile at a time.
+
+    Splits the grid of frame pairs into tiles of lead_block by following_block frames,
+    and searches each tile with get_most_similar_frames.
+    The stack with the fewest blocks is iterated in the outer loop,
+    so each of its blocks is only read once. The stacks can be lists of frames or
+    SpilledFrames, in which case only the blocks being compared are held in memory.
+
+    Args:
+        lead_vid: A sliceable sequence of ndarrays representing frames from the leading video.
+        following_vid: A sliceable sequence of ndarrays representing frames from the following video.
+        offset: An int representing the offset of the leading frames in the leading video.
+        lead_block: An int representing the number of leading frames in a tile.
+        following_block: An int representing the number of following frames in a tile.
+        multichannel: A bool specifying if the frames are in colour or greyscale.
+        method: A sting representing the image similarity method to use, see get_most_similar_frames.
+        verbose: An int controlling the printing of detailed information,
+                 verbose >= 3 prints which tile is being processed.
+        number_of_jobs: An int representing the number of threads to use, see get_most_similar_frames.
+        mask: An ndarray of bools, True where pixels are compared, or None, see get_most_similar_frames.
+
+    Returns:
+        An tuple with two ints representing the frame numbers of the two most similar frames,
+        and a  float representing the similarity score.
+    """
+
+    lead_outer: bool = -(-len(lead_vid) // lead_block) <= -(-len(following_vid) // following_block)
+    if lead_outer:
+        outer_vid, outer_block, inner_vid, inner_block = lead_vid, lead_block, following_vid, following_block
+    else:
+        outer_vid, outer_block, inner_vid, inner_block = following_vid, following_block, lead_vid, lead_block
+
+    best: Union[Tuple[int, int, float], None] = None
+    for outer_start in range(0, len(outer_vid), outer_block):
+        outer_frames: Sequence[np.ndarray] = outer_vid[outer_start:outer_start + outer_block]
+
+        for inner_start in range(0, len(inner_vid), inner_block):
+            inner_frames: Sequence[np.ndarray] = inner_vid[inner_start:inner_start + inner_block]
+
+            if lead_outer:
+                lead_start, lead_frames = outer_start, outer_frames
+                following_start, following_frames = inner_start, inner_frames
+            else:
+                lead_start, lead_frames = inner_start, inner_frames
+                following_start, following_frames = outer_start, outer_frames
+
+            if verbose >= 3:
+                print("Processing tile of leading frames", lead_start + 1, "to", lead_start + len(lead_frames),
+                      "and following frames", following_start + 1, "to", following_start + len(following_frames))
+
+            most_similar_frames: Tuple[int, int, float] = get_most_similar_frames(lead_frames, following_frames,
+                                                                                  offset + lead_start, multichannel,
+                                                                                  method, verbose if verbose >= 3 else 0,
+                                                                                  following_start, number_of_jobs,
+                                                                                  mask=mask)
+            if best is None or is_more_similar(most_similar_frames, best, method):
+                best = most_similar_frames
+
+            del inner_frames
+
+    return best
 
 
 @click.command(context_settings={"ignore_unknown_options": True}, options_metavar='<options>')
@@ -383,8 +1246,21 @@ def get_most_similar_frames(lead_vid: List[np.ndarray], following_vid: List[np.n
               help='0 = nothing, 1 = stage of operation, 2 = threading and time, 3 = detailed processing')
 @click.option('--colour/--greyscale', default=False, help='colour on / off (default off)')
 @click.option('--downscale/--no-downscale', default=True, help='downscale on / off (default on)')
+@click.option("--max-memory", type=click.IntRange(min=1, max=None, clamp=False), default=None, metavar='<megabytes>',
+              help='memory budget in megabytes, frames that don\'t fit are spilled to disk (default no budget)')
+@click.option('--cache/--no-cache', default=False, help='persistent result cache on / off (default off)')
+@click.option('--audio/--no-audio', default=False,
+              help='align by audio first and only search frames near the audio offset, needs ffmpeg (default off)')
+@click.option("--audio-band", type=click.FloatRange(min=0, max=None, clamp=False), default=0.5, metavar='<seconds>',
+              help='how far from the audio offset to search, in seconds (default 0.5)')
+@click.option("--crop", type=CropBox(), default=None, metavar='<x,y,width,height>',
+              help='only search this rectangle of the frames, in pixels of the original frames (default whole frames)')
+@click.option("--mask", type=click.Path(exists=True, dir_okay=False, readable=True), default=None, metavar='<image>',
+              help='image the size of the frames, non-zero pixels are ignored when comparing (default no mask)')
 def driver(lead_vid_path: str, following_vids_paths: List[str], seconds: int,
-           colour, downscale, method: str, verbose: int) -> None:
+           colour, downscale, method: str, verbose: int, max_memory: Union[int, None], cache: bool,
+           audio: bool, audio_band: float, crop: Union[Tuple[int, int, int, int], None],
+           mask: Union[str, None]) -> None:
     """Finds the best matching frames in the <seconds> last seconds of <leading video>
     and the <seconds> first seconds of <following videos>, using <methods> as similarity measure.
 
@@ -396,7 +1272,8 @@ def driver(lead_vid_path: str, following_vids_paths: List[str], seconds: int,
 
     <method> is the similarity measure to use. Valid options are: mse, nrmse, psnr, ssim.
     """
-    print(find_matching_frames(lead_vid_path, following_vids_paths, seconds, colour, downscale, method, verbose))
+    print(find_matching_frames(lead_vid_path, following_vids_paths, seconds, colour, downscale, method, verbose,
+                               max_memory, cache, audio=audio, audio_band=audio_band, crop=crop, mask=mask))
 
 
 if __name__ == "__main__":
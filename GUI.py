@@ -1,7 +1,9 @@
 from tkinter import *
 from tkinter import filedialog
 from tkinter import messagebox
+import click
 from AutoMerge import find_matching_frames
+from custom_params import CropBox
 
 
 class App:
@@ -13,6 +15,7 @@ class App:
         self.resize = BooleanVar()
         self.mode = StringVar()
         self.seconds = IntVar()
+        self.crop = StringVar()
 
         # The main frame, mainly for the padding
         self.main = Frame(window, padx=10, pady=10)
@@ -91,6 +94,19 @@ class App:
         self.seconds_spinbox.grid(row=5, column=0, columnspan=2, sticky=NW)
         self.seconds.set(3)
 
+        Label(self.options_frame, text="Crop (x,y,width,height):").grid(row=6, column=0, columnspan=2, sticky=NW)
+
+        self.crop_entry = Entry(self.options_frame, textvariable=self.crop)
+        self.crop_entry.grid(row=7, column=0, columnspan=2, sticky=NW)
+
+        Label(self.options_frame, text="Mask:").grid(row=8, column=0, columnspan=2, sticky=NW)
+
+        self.mask_entry = Entry(self.options_frame, state='readonly')
+        self.mask_entry.grid(row=9, column=0, columnspan=2, sticky=NW)
+
+        self.mask_add_button = Button(self.options_frame, text="...", width=3, command=self.browse_mask)
+        self.mask_add_button.grid(row=9, column=2, padx=5, sticky=NW)
+
     def browse_lead(self):
         file_path = filedialog.askopenfilename(title="Select file",
                                                    filetypes=(("Video files", "*.avi *.mp4 *m4v *.mkv *.mov"), ("All files", "*.*")))
@@ -108,6 +124,16 @@ class App:
         if file_path:  # file_path will be the empty string if the user cancels the dialog window
             self.following_listbox.insert(END, file_path)
 
+    def browse_mask(self):
+        file_path = filedialog.askopenfilename(title="Select file",
+                                                   filetypes=(("Image files", "*.png *.bmp *.jpg *.jpeg *.tif *.tiff"), ("All files", "*.*")))
+
+        # Cancelling the dialog window clears the mask
+        self.mask_entry.configure(state='normal')
+        self.mask_entry.delete(0, END)
+        self.mask_entry.insert(0, file_path)
+        self.mask_entry.configure(state='readonly')
+
     def go(self):
         leading_vid = self.lead_entry.get()
         following_vids = list(self.following_listbox.get(0, END))
@@ -126,10 +152,22 @@ class App:
             )
             return
 
+        crop = None
+        if self.crop.get().strip() != "":
+            try:
+                crop = CropBox().convert(self.crop.get().strip(), None, None)
+            except click.BadParameter as error:
+                messagebox.showwarning(
+                    "Bad input",
+                    "Bad crop rectangle. " + error.message
+                )
+                return
+
         # TODO: Put in try block to catch exceptions (wrong filetype, non existing file, etc.)
         result = find_matching_frames(leading_vid, following_vids, seconds=self.seconds.get(),
                                       multichannel=self.colour.get(), downscale=self.resize.get(),
-                                      method=self.mode.get(), verbose=3)
+                                      method=self.mode.get(), verbose=3, crop=crop,
+                                      mask=self.mask_entry.get() or None)
         print(result)  # TODO: present result in a better way. Maybe write to file?
         return
 
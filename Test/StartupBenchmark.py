@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+import statistics
+import subprocess
+from typing import *
+
+# Benchmarks the startup time of the command line tools, and the time until the first frame is decoded.
+# Usage: python StartupBenchmark.py [video] [runs]
+# The video defaults to red_blue_test.avi, generated by Tests.py.
+
+REPO_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_FRAME_SCRIPT: str = """
+import sys
+import cv2 as cv
+from AutoMerge import get_frames
+capture = cv.VideoCapture(sys.argv[1])
+frames = get_frames(0, 1, capture, multichannel=False, downscale=True)
+capture.release()
+"""
+
+
+# Runs a command runs times and returns the median wall time in seconds
+def time_command(command: List[str], runs: int) -> float:
+    times: List[float] = []
+    for run in range(runs):
+        start: float = time.perf_counter()
+        subprocess.run(command, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def run_benchmarks(video_path: str, runs: int) -> None:
+    commands: List[Tuple[str, List[str]]] = [
+        ("AutoMerge.py --help", [sys.executable, "AutoMerge.py", "--help"]),
+        ("stitch.py --help", [sys.executable, "stitch.py", "--help"]),
+        ("match_daemon.py match --help", [sys.executable, "match_daemon.py", "match", "--help"]),
+        ("result_cache.py --help", [sys.executable, "result_cache.py", "--help"]),
+    ]
+
+    if os.path.isfile(video_path):
+        commands.append(("First frame", [sys.executable, "-c", FIRST_FRAME_SCRIPT, os.path.abspath(video_path)]))
+    else:
+        print("No video at", video_path + ", skipping first frame latency. Run Tests.py to generate one.")
+
+    for name, command in commands:
+        print("{:<32} {:8.3f} s".format(name, time_command(command, runs)))
+
+
+if __name__ == "__main__":
+    run_benchmarks(sys.argv[1] if len(sys.argv) > 1 else "red_blue_test.avi",
+                   int(sys.argv[2]) if len(sys.argv) > 2 else 5)
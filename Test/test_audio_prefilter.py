@@ -0,0 +1,86 @@
+from typing import *
+import numpy as np
+import pytest
+from audio_prefilter import ENVELOPE_RATE, estimate_offset, get_audio_band
+
+WINDOW_SECONDS: int = 3
+
+
+# Returns smoothed random noise, a stand-in for a log energy envelope
+def smooth_noise(rng: np.random.Generator, length: int, smoothing: int = 10) -> np.ndarray:
+    noise: np.ndarray = rng.standard_normal(length + smoothing)
+    return np.convolve(noise, np.ones(smoothing) / smoothing, 'valid')[:length]
+
+
+# Returns the envelopes of the last WINDOW_SECONDS of a leading video and the first WINDOW_SECONDS
+# of a following video that repeats its last overlap_seconds, and the offset between them in seconds
+def make_envelopes(seed: int, overlap_seconds: float, noise: float = 0.0) -> Tuple[np.ndarray, np.ndarray, float]:
+    rng: np.random.Generator = np.random.default_rng(seed)
+    window: int = WINDOW_SECONDS * ENVELOPE_RATE
+    overlap: int = int(round(overlap_seconds * ENVELOPE_RATE))
+    signal: np.ndarray = smooth_noise(rng, 2 * window)
+    lead: np.ndarray = signal[:window] + noise * smooth_noise(rng, window, 3)
+    following: np.ndarray = signal[window - overlap:2 * window - overlap] + noise * smooth_noise(rng, window, 3)
+    return lead, following, (window - overlap) / ENVELOPE_RATE
+
+
+# Checks if band contains the following frame matching the first leading frame
+def band_contains_offset(band: Tuple[float, float, int], offset: float, fps: float) -> bool:
+    return abs(band[1] + offset * fps) <= band[2]
+
+
+@pytest.mark.parametrize("overlap_seconds", [0.3, 0.5, 1.0, 1.5, 2.0, 3.0])
+def test_estimate_offset_finds_known_offset(overlap_seconds: float) -> None:
+    for seed in range(20):
+        lead, following, offset = make_envelopes(seed, overlap_seconds)
+        estimate: Union[Tuple[float, float, float], None] = estimate_offset(lead, following)
+        assert estimate is not None
+        assert estimate[0] == pytest.approx(offset, abs=1 / ENVELOPE_RATE)
+        assert estimate[1] > 0.99
+
+
+# Overlaps shorter than half the window used to be excluded, so the true offset was never found
+@pytest.mark.parametrize("overlap_seconds", [1.0, 2.0])
+def test_get_audio_band_short_overlaps(overlap_seconds: float) -> None:
+    for seed in range(200):
+        lead, following, offset = make_envelopes(seed, overlap_seconds)
+        band: Union[Tuple[float, float, int], None] = get_audio_band(lead, following, 25.0, 25.0, 0.5)
+        assert band is not None
+        assert band_contains_offset(band, offset, 25.0)
+
+
+# With noisy envelopes the offset may be rejected, but an accepted band must contain the true offset
+@pytest.mark.parametrize("overlap_seconds", [1.0, 2.0])
+def test_get_audio_band_noisy_never_wrong(overlap_seconds: float) -> None:
+    accepted: int = 0
+    for seed in range(200):
+        lead, following, offset = make_envelopes(seed, overlap_seconds, noise=0.3)
+        band: Union[Tuple[float, float, int], None] = get_audio_band(lead, following, 25.0, 25.0, 0.5)
+        if band is not None:
+            accepted += 1
+            assert band_contains_offset(band, offset, 25.0)
+    assert accepted > 100
+
+
+def test_get_audio_band_frame_rates() -> None:
+    lead, following, offset = make_envelopes(0, 2.0)
+    slope, intercept, half_width = get_audio_band(lead, following, 25.0, 50.0, 0.5)
+    assert slope == pytest.approx(2.0)
+    assert intercept == pytest.approx(-offset * 50.0, abs=50.0 / ENVELOPE_RATE)
+    assert half_width == 25
+
+
+def test_get_audio_band_low_correlation_returns_none() -> None:
+    for seed in range(20):
+        rng: np.random.Generator = np.random.default_rng(seed)
+        window: int = WINDOW_SECONDS * ENVELOPE_RATE
+        assert get_audio_band(rng.standard_normal(window), rng.standard_normal(window), 25.0, 25.0) is None
+
+
+def test_get_audio_band_no_audio_returns_none() -> None:
+    lead, following, _ = make_envelopes(0, 2.0)
+    silent: np.ndarray = np.zeros(WINDOW_SECONDS * ENVELOPE_RATE)
+    assert get_audio_band(None, following, 25.0, 25.0) is None
+    assert get_audio_band(lead, None, 25.0, 25.0) is None
+    assert get_audio_band(lead, silent, 25.0, 25.0) is None
+    assert estimate_offset(silent, silent) is None
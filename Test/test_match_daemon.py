@@ -0,0 +1,196 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from typing import *
+import numpy as np
+import pytest
+from frame_cache import FrameCache
+from match_daemon import MatchServer, get_url, validate_request
+
+VALID_REQUEST: Dict[str, Any] = {"lead": "/videos/vid1.avi", "following": ["/videos/vid2.avi"],
+                                 "seconds": 3, "method": "mse"}
+
+
+# Returns a stack of frames of size bytes
+def make_stack(size: int) -> List[np.ndarray]:
+    return [np.zeros(size // 2, dtype=np.uint8), np.zeros(size - size // 2, dtype=np.uint8)]
+
+
+def test_frame_cache_evicts_least_recently_used() -> None:
+    frame_cache: FrameCache = FrameCache(300)
+    for key in ["a", "b", "c"]:
+        frame_cache.put((key,), make_stack(100))
+
+    assert frame_cache.get(("a",)) is not None
+    frame_cache.put(("d",), make_stack(100))
+
+    assert frame_cache.get(("b",)) is None
+    for key in ["a", "c", "d"]:
+        assert frame_cache.get((key,)) is not None
+    assert frame_cache.stats()["bytes"] == 300
+
+
+def test_frame_cache_replacing_a_stack_keeps_byte_count() -> None:
+    frame_cache: FrameCache = FrameCache(300)
+    frame_cache.put(("a",), make_stack(200))
+    frame_cache.put(("a",), make_stack(50))
+    frame_cache.put(("b",), make_stack(250))
+
+    stats: Dict[str, int] = frame_cache.stats()
+    assert (stats["stacks"], stats["bytes"]) == (2, 300)
+    assert frame_cache.get(("a",))[0].nbytes == 25
+
+
+def test_frame_cache_skips_oversize_stacks_and_missing_keys() -> None:
+    frame_cache: FrameCache = FrameCache(300)
+    frame_cache.put(("a",), make_stack(100))
+    frame_cache.put(("big",), make_stack(301))
+    frame_cache.put(None, make_stack(100))
+
+    assert frame_cache.get(("big",)) is None
+    assert frame_cache.get(None) is None
+    assert frame_cache.get(("a",)) is not None
+    stats: Dict[str, int] = frame_cache.stats()
+    assert (stats["stacks"], stats["bytes"], stats["hits"], stats["misses"]) == (1, 100, 1, 2)
+
+
+def test_frame_cache_keys(tmp_path) -> None:
+    path: str = str(tmp_path / "vid.avi")
+    with open(path, "wb") as file:
+        file.write(b"frames")
+
+    key: Tuple = FrameCache.make_key(path, 0, 75, False, True)
+    assert FrameCache.make_key(path, 0, 75, False, True) == key
+    assert FrameCache.make_key(path, 0, 75, False, True, (0, 0, 10, 10)) != key
+    assert FrameCache.make_key(path, 0, 75, True, True) != key
+
+    with open(path, "ab") as file:
+        file.write(b" changed")
+    assert FrameCache.make_key(path, 0, 75, False, True) != key
+    assert FrameCache.make_key(str(tmp_path / "missing.avi"), 0, 75, False, True) is None
+
+
+def test_validate_request_accepts_valid_requests() -> None:
+    assert validate_request(VALID_REQUEST) is None
+    assert validate_request(dict(VALID_REQUEST, verbose=3, colour=True, downscale=False, cache=True, audio=True,
+                                 audio_band=1, crop=[0, 0, 640, 360], mask="/videos/mask.png",
+                                 max_memory=None)) is None
+
+
+@pytest.mark.parametrize("changes, error", [
+    ({"lead": None}, "lead"),
+    ({"following": []}, "following"),
+    ({"following": "/videos/vid2.avi"}, "following"),
+    ({"seconds": 0}, "seconds"),
+    ({"seconds": True}, "seconds"),
+    ({"seconds": 1.5}, "seconds"),
+    ({"method": "sad"}, "method"),
+    ({"verbose": 4}, "verbose"),
+    ({"verbose": True}, "verbose"),
+    ({"colour": 1}, "colour"),
+    ({"downscale": "no"}, "downscale"),
+    ({"cache": None}, "cache"),
+    ({"audio": "yes"}, "audio"),
+    ({"max_memory": 512}, "max_memory"),
+    ({"max_memory": True}, "max_memory"),
+    ({"audio_band": -1}, "audio_band"),
+    ({"audio_band": True}, "audio_band"),
+    ({"audio_band": float("nan")}, "audio_band"),
+    ({"crop": [0, 0, 50]}, "crop"),
+    ({"crop": [True, 0, 50, 50]}, "crop"),
+    ({"crop": [0, 0, 0, 50]}, "crop"),
+    ({"crop": "0,0,50,50"}, "crop"),
+    ({"mask": 1}, "mask"),
+])
+def test_validate_request_rejects_invalid_requests(changes: Dict[str, Any], error: str) -> None:
+    message: Union[str, None] = validate_request(dict(VALID_REQUEST, **changes))
+    assert message is not None and message.startswith(error)
+    assert validate_request([VALID_REQUEST]) is not None
+
+
+def test_get_url() -> None:
+    assert get_url("127.0.0.1", 8765, "/match") == "http://127.0.0.1:8765/match"
+    assert get_url("::1", 8765) == "http://[::1]:8765"
+
+
+# Starts a server whose searches wait for release, and returns it with the event
+def start_server(max_workers: int, max_queue: int) -> Tuple[MatchServer, threading.Event]:
+    release: threading.Event = threading.Event()
+
+    def find_matching_frames(*args, **kwargs) -> List[Tuple[int, int, float]]:
+        release.wait(10)
+        return [(70, 5, 0.5)]
+
+    server: MatchServer = MatchServer(("127.0.0.1", 0), find_matching_frames, FrameCache(0), max_workers, max_queue)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, release
+
+
+# Sends a request to server, returns the status code, the JSON body, and the headers
+def post(server: MatchServer, body: Any, path: str = "/match") -> Tuple[int, Dict[str, Any], Any]:
+    request = urllib.request.Request(get_url("127.0.0.1", server.server_address[1], path),
+                                     data=json.dumps(body).encode(), headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read()), response.headers
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read()), error.headers
+
+
+def test_admit_limits_workers_and_queue() -> None:
+    server, release = start_server(2, 1)
+    try:
+        assert all(server.admit() for _ in range(3))
+        assert not server.admit()
+        assert server.stats()["rejected"] == 1
+    finally:
+        release.set()
+        server.shutdown()
+        server.server_close()
+
+
+def test_busy_server_turns_requests_away() -> None:
+    server, release = start_server(1, 1)
+    responses: List[Tuple[int, Dict[str, Any], Any]] = []
+    try:
+        clients: List[threading.Thread] = [threading.Thread(target=lambda: responses.append(post(server, VALID_REQUEST)))
+                                           for _ in range(2)]
+        for client in clients:
+            client.start()
+        # Wait for both requests to hold the worker and the queue
+        for _ in range(1000):
+            if server.stats()["admitted"] == 2:
+                break
+            threading.Event().wait(0.01)
+        assert server.stats()["admitted"] == 2
+
+        status, body, headers = post(server, VALID_REQUEST)
+        assert status == 503
+        assert headers["Retry-After"] == "1"
+
+        release.set()
+        for client in clients:
+            client.join(10)
+        assert [response[:2] for response in responses] == [(200, {"results": [[70, 5, 0.5]]})] * 2
+
+        stats: Dict[str, Any] = server.stats()
+        assert (stats["admitted"], stats["served"], stats["rejected"]) == (0, 2, 1)
+    finally:
+        release.set()
+        server.shutdown()
+        server.server_close()
+
+
+def test_invalid_requests_get_400() -> None:
+    server, release = start_server(1, 0)
+    release.set()
+    try:
+        status, body, _ = post(server, dict(VALID_REQUEST, seconds=True))
+        assert status == 400
+        assert body["error"].startswith("seconds")
+        assert post(server, VALID_REQUEST, "/unknown")[0] == 404
+        assert server.stats()["served"] == 0
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,125 @@
+import os
+import itertools
+from typing import *
+import numpy as np
+import pytest
+from memory_budget import MEGABYTE, SpilledFrames, get_memory_usage, plan_tiles
+
+FRAME_SHAPE: Tuple[int, int] = (16, 16)
+
+
+# Returns leading and following frames where leading frames 3 and 6 and following frames 2 and 5
+# are the same frame, so four pairs tie for the best match
+def make_tied_frames(seed: int = 0) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    rng: np.random.Generator = np.random.default_rng(seed)
+    lead_vid: List[np.ndarray] = [rng.integers(0, 256, FRAME_SHAPE, dtype=np.uint8) for _ in range(9)]
+    following_vid: List[np.ndarray] = [rng.integers(0, 256, FRAME_SHAPE, dtype=np.uint8) for _ in range(7)]
+    lead_vid[6] = lead_vid[3].copy()
+    following_vid[2] = lead_vid[3].copy()
+    following_vid[5] = lead_vid[3].copy()
+    return lead_vid, following_vid
+
+
+# Spills frames to a scratch file in directory
+def spill(frames: List[np.ndarray], directory: str, name: str) -> SpilledFrames:
+    spilled: SpilledFrames = SpilledFrames(os.path.join(directory, name), frames[0].shape)
+    for frame in frames:
+        spilled.append(frame)
+    spilled.close()
+    return spilled
+
+
+def test_spilled_frames_round_trip(tmp_path) -> None:
+    lead_vid, _ = make_tied_frames()
+    spilled: SpilledFrames = spill(lead_vid, str(tmp_path), "lead.bin")
+    assert len(spilled) == len(lead_vid)
+    for start, stop in [(0, 9), (2, 5), (8, 20), (5, 5)]:
+        block: np.ndarray = spilled[start:stop]
+        assert block.shape == (len(lead_vid[start:stop]),) + FRAME_SHAPE
+        for frame, expected in zip(block, lead_vid[start:stop]):
+            assert np.array_equal(frame, expected)
+
+
+# Spills a stack four times larger than the budget, and reads it back in blocks that fit in the budget
+def test_spilled_frames_stay_within_budget(tmp_path) -> None:
+    if not os.path.exists("/proc/self/statm"):
+        pytest.skip("resident memory is only measured exactly on Linux")
+
+    budget: int = 64 * MEGABYTE
+    frame_shape: Tuple[int, int] = (1024, 1024)
+    number_of_frames: int = 4 * budget // MEGABYTE
+    block_size: int = budget // (4 * MEGABYTE)
+
+    baseline: int = get_memory_usage()
+    spilled: SpilledFrames = SpilledFrames(str(tmp_path / "stack.bin"), frame_shape)
+    for index in range(number_of_frames):
+        spilled.append(np.full(frame_shape, index % 256, dtype=np.uint8))
+        assert get_memory_usage() - baseline < budget
+    spilled.close()
+
+    for start in range(0, number_of_frames, block_size):
+        block: np.ndarray = spilled[start:start + block_size]
+        assert block[-1, 0, 0] == (start + block_size - 1) % 256
+        assert get_memory_usage() - baseline < budget
+        del block
+
+
+@pytest.mark.parametrize("method", ["mse", "nrmse", "psnr", "ssim"])
+def test_tiled_search_matches_untiled_search(method: str, tmp_path) -> None:
+    pytest.importorskip("joblib")
+    pytest.importorskip("skimage")
+    from AutoMerge import get_most_similar_frames, get_most_similar_frames_tiled
+
+    lead_vid, following_vid = make_tied_frames()
+    expected: Tuple[int, int, float] = get_most_similar_frames(lead_vid, following_vid, 100, False, method)
+    # The lowest frame numbers win ties
+    assert expected[:2] == (103, 2)
+
+    stacks: List[Tuple[Sequence[np.ndarray], Sequence[np.ndarray]]] = [
+        (lead_vid, following_vid),
+        (spill(lead_vid, str(tmp_path), "lead.bin"), spill(following_vid, str(tmp_path), "following.bin")),
+    ]
+    for (lead_stack, following_stack), lead_block, following_block in itertools.product(stacks, [1, 2, 4, 9],
+                                                                                          [1, 3, 7]):
+        assert get_most_similar_frames_tiled(lead_stack, following_stack, 100, lead_block, following_block,
+                                             False, method) == expected
+
+
+def test_plan_tiles_keeps_smaller_stack_resident() -> None:
+    # Leading stack of 10 frames is smaller than the following stack of 100 frames
+    lead_block, following_block = plan_tiles(10, 1000, 100, 1000, 50000, False, False)
+    assert lead_block == 10
+    assert following_block == 40
+
+    lead_block, following_block = plan_tiles(100, 1000, 10, 1000, 50000, False, False)
+    assert following_block == 10
+    assert lead_block == 40
+
+
+def test_plan_tiles_splits_budget_when_neither_fits() -> None:
+    assert plan_tiles(100, 1000, 100, 1000, 50000, False, False) == (25, 25)
+    # Never less than one frame of each, even if the budget is too small
+    assert plan_tiles(100, 1000, 100, 1000, 10, False, False) == (1, 1)
+
+
+def test_plan_tiles_stays_within_budget() -> None:
+    rng: np.random.Generator = np.random.default_rng(0)
+    for _ in range(2000):
+        lead_length, following_length = (int(length) for length in rng.integers(1, 200, 2))
+        lead_frame_bytes, following_frame_bytes = (int(size) for size in rng.integers(1, 5000, 2))
+        lead_in_memory, following_in_memory = (bool(flag) for flag in rng.integers(0, 2, 2))
+
+        # Stacks are only kept in memory if they fit with room for a frame of the other,
+        # see find_matching_frames_within_budget
+        required: int = ((lead_length if lead_in_memory else 1) * lead_frame_bytes
+                         + (following_length if following_in_memory else 1) * following_frame_bytes)
+        budget: int = required + int(rng.integers(0, 500000))
+
+        lead_block, following_block = plan_tiles(lead_length, lead_frame_bytes, following_length,
+                                                 following_frame_bytes, budget, lead_in_memory, following_in_memory)
+        assert 1 <= lead_block <= lead_length
+        assert 1 <= following_block <= following_length
+
+        resident: int = ((lead_length if lead_in_memory else lead_block) * lead_frame_bytes
+                         + (following_length if following_in_memory else following_block) * following_frame_bytes)
+        assert resident <= budget
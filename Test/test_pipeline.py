@@ -0,0 +1,88 @@
+import threading
+import time
+from typing import *
+import numpy as np
+import pytest
+
+FPS: int = 25
+SECONDS: int = 1
+
+
+# Stands in for an OpenCV video capture, the frames themselves come from the patched decoders
+class StubCapture:
+    def __init__(self, path: str):
+        self.path = path
+
+    def isOpened(self) -> bool:
+        return True
+
+    def get(self, property_id: int) -> float:
+        import cv2 as cv
+        return {cv.CAP_PROP_FRAME_HEIGHT: 32,
+                cv.CAP_PROP_FRAME_WIDTH: 32,
+                cv.CAP_PROP_FRAME_COUNT: 10 * FPS,
+                cv.CAP_PROP_FPS: FPS}[property_id]
+
+    def release(self) -> None:
+        pass
+
+
+# Patches the decoders to return frames tagged with the path of their video after delays[path] seconds,
+# or raise a ValueError for the paths in failing, and the search to return the index of the following video
+def patch_pipeline(monkeypatch, paths: List[str], delays: Dict[str, float],
+                   failing: Sequence[str] = ()) -> None:
+    cv = pytest.importorskip("cv2")
+    import AutoMerge
+
+    def get_following_frames(path: str, *args, **kwargs) -> Tuple[List[str], float, None]:
+        time.sleep(delays[path])
+        if path in failing:
+            raise ValueError("Could not decode " + path)
+        return [path], float(FPS), None
+
+    def get_most_similar_frames(lead_vid: List[np.ndarray], following_vid: List[str], offset: int,
+                                *args, **kwargs) -> Tuple[int, int, float]:
+        return offset, paths.index(following_vid[0]), 0.0
+
+    monkeypatch.setattr(cv, "VideoCapture", StubCapture)
+    monkeypatch.setattr(AutoMerge, "get_frames_cached",
+                        lambda *args, **kwargs: [np.zeros((32, 32, 3), dtype=np.uint8)] * (FPS * SECONDS))
+    monkeypatch.setattr(AutoMerge, "get_following_frames", get_following_frames)
+    monkeypatch.setattr(AutoMerge, "get_most_similar_frames", get_most_similar_frames)
+
+
+def test_results_keep_following_order(monkeypatch) -> None:
+    paths: List[str] = ["vid" + str(i) + ".avi" for i in range(6)]
+    # Earlier videos take longer to decode, so they finish out of order
+    delays: Dict[str, float] = dict(zip(paths, [0.3, 0.0, 0.2, 0.05, 0.15, 0.0]))
+    patch_pipeline(monkeypatch, paths, delays)
+    from AutoMerge import find_matching_frames
+
+    out: List[Tuple[int, int, float]] = find_matching_frames("lead.avi", paths, SECONDS)
+    lead_vid_start: int = 10 * FPS - FPS * SECONDS - 1
+    assert out == [(lead_vid_start, i, 0.0) for i in range(len(paths))]
+
+
+@pytest.mark.parametrize("failing_index", [0, 3, 5])
+def test_decoder_exception_propagates(monkeypatch, failing_index: int) -> None:
+    # More videos than decoders and queue slots, so the remaining decoders block unless they are drained
+    paths: List[str] = ["vid" + str(i) + ".avi" for i in range(8)]
+    delays: Dict[str, float] = {path: 0.0 if i == failing_index else 0.05 for i, path in enumerate(paths)}
+    patch_pipeline(monkeypatch, paths, delays, failing=[paths[failing_index]])
+    from AutoMerge import find_matching_frames
+
+    raised: List[BaseException] = []
+
+    def search() -> None:
+        try:
+            find_matching_frames("lead.avi", paths, SECONDS)
+        except BaseException as exception:
+            raised.append(exception)
+
+    thread: threading.Thread = threading.Thread(target=search, daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+    assert not thread.is_alive(), "find_matching_frames deadlocked after a decoder failed"
+    assert len(raised) == 1
+    assert isinstance(raised[0], ValueError)
+    assert paths[failing_index] in str(raised[0])
@@ -0,0 +1,145 @@
+import os
+import shutil
+import stat
+from typing import *
+import numpy as np
+import pytest
+from result_cache import EDGE_BYTES, NUMBER_OF_SAMPLES, SAMPLE_BYTES, ResultCache, fingerprint_file
+
+FILE_SIZE: int = 1024 * 1024
+RESULT: Tuple[int, int, float] = (70, 5, 12.5)
+
+
+# Writes a file of random bytes, larger than the part fingerprint_file hashes
+def write_video(path: str, seed: int) -> str:
+    with open(path, "wb") as file:
+        file.write(np.random.default_rng(seed).integers(0, 256, FILE_SIZE, dtype=np.uint8).tobytes())
+    return path
+
+
+# Flips the byte at offset in the file at path
+def flip_byte(path: str, offset: int) -> None:
+    with open(path, "r+b") as file:
+        file.seek(offset)
+        value: int = file.read(1)[0]
+        file.seek(offset)
+        file.write(bytes([value ^ 0xFF]))
+
+
+def get(result_cache: ResultCache, lead: str, following: str,
+        options: Union[Dict[str, Any], None] = None) -> Union[Tuple[int, int, float], None]:
+    return result_cache.get(lead, following, 3, False, True, "mse", options)
+
+
+def put(result_cache: ResultCache, lead: str, following: str, options: Union[Dict[str, Any], None] = None) -> None:
+    result_cache.put(lead, following, 3, False, True, "mse", RESULT, options)
+
+
+@pytest.fixture
+def videos(tmp_path) -> List[str]:
+    return [write_video(str(tmp_path / ("vid" + str(index) + ".avi")), index) for index in range(4)]
+
+
+def test_renamed_and_copied_files_hit(tmp_path, videos: List[str]) -> None:
+    result_cache: ResultCache = ResultCache(str(tmp_path / "cache"))
+    put(result_cache, videos[0], videos[1])
+
+    copied: str = shutil.copy(videos[0], str(tmp_path / "copy.avi"))
+    renamed: str = str(tmp_path / "renamed.avi")
+    os.rename(videos[1], renamed)
+
+    assert get(ResultCache(str(tmp_path / "cache")), copied, renamed) == RESULT
+
+
+def test_changed_sampled_byte_misses(tmp_path, videos: List[str]) -> None:
+    step: int = (FILE_SIZE - 2 * EDGE_BYTES) // (NUMBER_OF_SAMPLES + 1)
+    # The head, a sample in between, and the tail
+    for offset in [0, EDGE_BYTES + 3 * step + SAMPLE_BYTES // 2, FILE_SIZE - 1]:
+        result_cache: ResultCache = ResultCache(str(tmp_path / ("cache" + str(offset))))
+        put(result_cache, videos[0], videos[1])
+        fingerprint: str = fingerprint_file(videos[0])
+
+        flip_byte(videos[0], offset)
+        assert fingerprint_file(videos[0]) != fingerprint
+        assert get(ResultCache(str(tmp_path / ("cache" + str(offset)))), videos[0], videos[1]) is None
+        flip_byte(videos[0], offset)
+
+
+def test_options_change_the_key(tmp_path, videos: List[str]) -> None:
+    result_cache: ResultCache = ResultCache(str(tmp_path / "cache"))
+    put(result_cache, videos[0], videos[1])
+    audio_options: Dict[str, Any] = {"audio_band": 0.5}
+    put(result_cache, videos[0], videos[2], audio_options)
+
+    # Empty options are the same as no options
+    assert get(result_cache, videos[0], videos[1], {}) == RESULT
+    assert get(result_cache, videos[0], videos[2], audio_options) == RESULT
+    for options in [{"audio_band": 1.0}, {"crop": [0, 0, 640, 360]}, {"mask": fingerprint_file(videos[3])},
+                    dict(audio_options, crop=[0, 0, 640, 360])]:
+        assert get(result_cache, videos[0], videos[1], options) is None
+        assert get(result_cache, videos[0], videos[2], options) is None
+    assert get(result_cache, videos[0], videos[2]) is None
+
+
+def test_invalidate_only_removes_results_of_path(tmp_path, videos: List[str]) -> None:
+    result_cache: ResultCache = ResultCache(str(tmp_path / "cache"))
+    put(result_cache, videos[0], videos[1])
+    put(result_cache, videos[2], videos[0])
+    put(result_cache, videos[2], videos[3])
+
+    assert result_cache.invalidate([videos[0]]) == 2
+    assert get(result_cache, videos[0], videos[1]) is None
+    assert get(result_cache, videos[2], videos[0]) is None
+    assert get(result_cache, videos[2], videos[3]) == RESULT
+    assert result_cache.stats()["entries"] == 1
+
+
+def test_lookups_only_read(tmp_path, videos: List[str]) -> None:
+    result_cache: ResultCache = ResultCache(str(tmp_path / "cache"))
+    put(result_cache, videos[0], videos[1])
+    with open(result_cache.path, "rb") as file:
+        before: bytes = file.read()
+
+    assert get(result_cache, videos[0], videos[1]) == RESULT
+    assert get(result_cache, videos[0], videos[2]) is None
+    with open(result_cache.path, "rb") as file:
+        assert file.read() == before
+
+    assert result_cache.stats()["hits"] == 1
+    result_cache.flush_stats()
+    cache_stats: Dict[str, int] = ResultCache(str(tmp_path / "cache")).stats()
+    assert (cache_stats["hits"], cache_stats["misses"]) == (1, 1)
+
+
+# A cache that can't be created, even by root, only misses
+def test_uncreatable_cache_misses(tmp_path, videos: List[str]) -> None:
+    result_cache: ResultCache = ResultCache(os.path.join(videos[3], "cache"))
+    assert get(result_cache, videos[0], videos[1]) is None
+    put(result_cache, videos[0], videos[1])
+    assert get(result_cache, videos[0], videos[1]) is None
+    result_cache.flush_stats()
+
+    cache_stats: Dict[str, int] = result_cache.stats()
+    assert (cache_stats["entries"], cache_stats["hits"], cache_stats["misses"], cache_stats["size"]) == (0, 0, 2, 0)
+
+
+@pytest.mark.skipif(not hasattr(os, "geteuid") or os.geteuid() == 0, reason="root can write to read-only files")
+def test_read_only_cache(tmp_path, videos: List[str]) -> None:
+    cache_dir: str = str(tmp_path / "cache")
+    put(ResultCache(cache_dir), videos[0], videos[1])
+    os.chmod(os.path.join(cache_dir, "results.sqlite"), stat.S_IRUSR)
+    os.chmod(cache_dir, stat.S_IRUSR | stat.S_IXUSR)
+    try:
+        result_cache: ResultCache = ResultCache(cache_dir)
+        assert get(result_cache, videos[0], videos[1]) == RESULT
+        put(result_cache, videos[0], videos[2])
+        result_cache.flush_stats()
+        assert result_cache.stats()["hits"] == 1
+
+        # A new cache can't be created in a read-only directory
+        uncreatable: ResultCache = ResultCache(os.path.join(cache_dir, "new"))
+        assert get(uncreatable, videos[0], videos[1]) is None
+        put(uncreatable, videos[0], videos[1])
+        assert uncreatable.stats()["entries"] == 0
+    finally:
+        os.chmod(cache_dir, stat.S_IRWXU)
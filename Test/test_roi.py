@@ -0,0 +1,211 @@
+from typing import *
+import numpy as np
+import pytest
+from AutoMerge import (SSIM_WINDOW_SIZE, get_downscaled_height, get_masked_frame_shape,
+                       get_most_similar_frames, mask_frames)
+
+FRAME_SHAPE: Tuple[int, int, int] = (24, 32, 3)
+
+
+# Stands in for an OpenCV video capture of frames
+class FrameCapture:
+    def __init__(self, frames: List[np.ndarray]):
+        self.frames = frames
+        self.position = 0
+
+    def get(self, property_id: int) -> float:
+        import cv2 as cv
+        return {cv.CAP_PROP_FRAME_HEIGHT: self.frames[0].shape[0],
+                cv.CAP_PROP_FRAME_WIDTH: self.frames[0].shape[1],
+                cv.CAP_PROP_FRAME_COUNT: len(self.frames),
+                cv.CAP_PROP_FPS: 25}[property_id]
+
+    def set(self, property_id: int, value: float) -> bool:
+        self.position = int(value)
+        return True
+
+    def read(self) -> Tuple[bool, Union[np.ndarray, None]]:
+        if self.position >= len(self.frames):
+            return False, None
+        self.position += 1
+        return True, self.frames[self.position - 1]
+
+
+# Returns a frame where each pixel holds its own row and column, so crops can be located
+def make_index_frame(height: int, width: int) -> np.ndarray:
+    rows, columns = np.indices((height, width))
+    return np.stack([rows, columns], axis=2)
+
+
+# Returns a mask of shape where the rectangle top:bottom, left:right is compared
+def make_mask(shape: Tuple[int, int], top: int, bottom: int, left: int, right: int) -> np.ndarray:
+    mask: np.ndarray = np.zeros(shape, dtype=bool)
+    mask[top:bottom, left:right] = True
+    return mask
+
+
+def test_get_downscaled_height() -> None:
+    assert get_downscaled_height(1080, 1080) == 480
+    assert get_downscaled_height(540, 1080) == 240
+    assert get_downscaled_height(100, 270) == 177
+    assert get_downscaled_height(1, 1080) == 1
+
+
+@pytest.mark.parametrize("method", ['mse', 'nrmse', 'psnr'])
+@pytest.mark.parametrize("multichannel", [True, False])
+def test_mask_frames_keeps_compared_pixels(method: str, multichannel: bool) -> None:
+    rng: np.random.Generator = np.random.default_rng(0)
+    shape: Tuple[int, ...] = FRAME_SHAPE if multichannel else FRAME_SHAPE[:2]
+    frames: List[np.ndarray] = [rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(3)]
+    mask: np.ndarray = rng.random(FRAME_SHAPE[:2]) < 0.3
+    masked_frames, masked_mask = mask_frames(frames, mask, method)
+    assert masked_mask is None
+    for masked_frame, frame in zip(masked_frames, frames):
+        assert np.array_equal(masked_frame, frame[mask])
+
+
+@pytest.mark.parametrize("frame_size, box", [
+    ((48, 64), (20, 21, 30, 31)),   # A single pixel in the middle
+    ((48, 64), (0, 1, 0, 1)),       # A single pixel in the top left corner
+    ((48, 64), (47, 48, 63, 64)),   # A single pixel in the bottom right corner
+    ((48, 64), (0, 3, 10, 40)),     # A strip along the top edge
+    ((48, 64), (5, 30, 8, 50)),     # A region larger than the window
+    ((6, 8), (2, 3, 3, 4)),         # A frame smaller than the window
+])
+def test_mask_frames_grows_ssim_box(frame_size: Tuple[int, int], box: Tuple[int, int, int, int]) -> None:
+    height, width = frame_size
+    top, bottom, left, right = box
+    frame: np.ndarray = make_index_frame(height, width)
+    mask: np.ndarray = make_mask(frame_size, top, bottom, left, right)
+    (masked_frame,), masked_mask = mask_frames([frame], mask, 'ssim')
+
+    # The box is at least the window, or the frame where it's smaller, and no larger than it needs to be
+    box_height, box_width = masked_mask.shape
+    assert box_height == max(bottom - top, min(SSIM_WINDOW_SIZE, height))
+    assert box_width == max(right - left, min(SSIM_WINDOW_SIZE, width))
+    assert masked_frame.shape[:2] == masked_mask.shape
+
+    # The box is a contiguous region within the frame, and contains every compared pixel
+    box_top: int = int(masked_frame[0, 0, 0])
+    box_left: int = int(masked_frame[0, 0, 1])
+    assert 0 <= box_top and box_top + box_height <= height
+    assert 0 <= box_left and box_left + box_width <= width
+    assert np.array_equal(masked_frame, frame[box_top:box_top + box_height, box_left:box_left + box_width])
+    assert np.array_equal(masked_mask, mask[box_top:box_top + box_height, box_left:box_left + box_width])
+    assert masked_mask.sum() == mask.sum()
+
+    # Masking the masked frames again changes nothing
+    (remasked_frame,), remasked_mask = mask_frames([masked_frame], masked_mask, 'ssim')
+    assert np.array_equal(remasked_frame, masked_frame)
+    assert np.array_equal(remasked_mask, masked_mask)
+
+
+@pytest.mark.parametrize("method", ['mse', 'nrmse', 'psnr', 'ssim'])
+@pytest.mark.parametrize("multichannel", [True, False])
+def test_get_masked_frame_shape(method: str, multichannel: bool) -> None:
+    shape: Tuple[int, ...] = FRAME_SHAPE if multichannel else FRAME_SHAPE[:2]
+    frame: np.ndarray = np.zeros(shape, dtype=np.uint8)
+    for mask in [make_mask(FRAME_SHAPE[:2], 3, 5, 4, 6), make_mask(FRAME_SHAPE[:2], 2, 20, 1, 30)]:
+        masked_frames, _ = mask_frames([frame], mask, method)
+        assert get_masked_frame_shape(shape, mask, method) == masked_frames[0].shape
+
+
+# Scores of a pair of frames, computed from the compared pixels only
+def get_expected_score(lead_pixels: np.ndarray, following_pixels: np.ndarray, method: str) -> float:
+    mse: float = float(np.mean((lead_pixels.astype(np.float64) - following_pixels.astype(np.float64)) ** 2))
+    if method == 'mse':
+        return mse
+    elif method == 'nrmse':
+        return float(np.sqrt(mse) / (int(lead_pixels.max()) - int(lead_pixels.min())))
+    else:
+        return float(10 * np.log10(255 ** 2 / mse))
+
+
+@pytest.mark.parametrize("method", ['mse', 'nrmse', 'psnr'])
+def test_masked_search_compares_only_masked_pixels(method: str) -> None:
+    pytest.importorskip("joblib")
+    pytest.importorskip("skimage")
+
+    rng: np.random.Generator = np.random.default_rng(1)
+    lead_vid: List[np.ndarray] = [rng.integers(0, 256, FRAME_SHAPE, dtype=np.uint8) for _ in range(4)]
+    following_vid: List[np.ndarray] = [rng.integers(0, 256, FRAME_SHAPE, dtype=np.uint8) for _ in range(5)]
+    mask: np.ndarray = make_mask(FRAME_SHAPE[:2], 4, 16, 6, 20)
+    # Leading frame 2 and following frame 3 are alike inside the mask, and different outside it
+    following_vid[3][mask] = np.clip(lead_vid[2][mask].astype(np.int64) + rng.integers(-3, 4, (int(mask.sum()), 3)),
+                                     0, 255).astype(np.uint8)
+
+    pairs: List[Tuple[int, int, float]] = [(i, j, get_expected_score(lead_frame[mask], following_frame[mask], method))
+                                           for i, lead_frame in enumerate(lead_vid)
+                                           for j, following_frame in enumerate(following_vid)]
+    if method == 'psnr':
+        expected: Tuple[int, int, float] = max(pairs, key=lambda pair: pair[2])
+    else:
+        expected = min(pairs, key=lambda pair: pair[2])
+    assert expected[:2] == (2, 3)
+
+    result: Tuple[int, int, float] = get_most_similar_frames(lead_vid, following_vid, 0, method=method,
+                                                             number_of_jobs=1, mask=mask)
+    assert result[:2] == expected[:2]
+    assert result[2] == pytest.approx(expected[2])
+
+
+@pytest.mark.parametrize("multichannel", [True, False])
+@pytest.mark.parametrize("downscale", [False, True])
+@pytest.mark.parametrize("crop", [None, (10, 20, 300, 100), (600, 200, 100, 100)])
+def test_get_frame_shape_matches_get_frames(multichannel: bool, downscale: bool,
+                                           crop: Union[Tuple[int, int, int, int], None]) -> None:
+    pytest.importorskip("cv2")
+    pytest.importorskip("joblib")
+    pytest.importorskip("skimage")
+    from AutoMerge import get_crop_box, get_frame_shape, get_frames
+
+    rng: np.random.Generator = np.random.default_rng(2)
+    capture: FrameCapture = FrameCapture([rng.integers(0, 256, (270, 640, 3), dtype=np.uint8) for _ in range(2)])
+    if crop is not None:
+        crop = get_crop_box(capture, crop)
+    frames: List[np.ndarray] = get_frames(0, 2, capture, multichannel, downscale, crop=crop)
+    assert get_frame_shape(capture, multichannel, downscale, crop) == frames[0].shape
+
+
+def test_get_crop_box_fits_frames() -> None:
+    pytest.importorskip("cv2")
+    from AutoMerge import get_crop_box
+
+    capture: FrameCapture = FrameCapture([np.zeros((270, 640, 3), dtype=np.uint8)])
+    assert get_crop_box(capture, (10, 20, 300, 100)) == (10, 20, 300, 100)
+    assert get_crop_box(capture, (600, 200, 100, 100)) == (600, 200, 40, 70)
+    assert get_crop_box(capture, (640, 0, 10, 10)) is None
+
+
+def test_load_mask_fits_frames() -> None:
+    pytest.importorskip("cv2")
+    from AutoMerge import load_mask
+
+    rng: np.random.Generator = np.random.default_rng(3)
+    capture: FrameCapture = FrameCapture([np.zeros((40, 60, 3), dtype=np.uint8)])
+    ignored: np.ndarray = (rng.random((20, 30)) < 0.5).astype(np.uint8) * 255
+    # Stretched to the size of the frames
+    stretched: np.ndarray = np.repeat(np.repeat(ignored, 2, axis=0), 2, axis=1)
+
+    assert np.array_equal(load_mask(stretched, capture, None, (40, 60, 3)), stretched == 0)
+    assert np.array_equal(load_mask(ignored, capture, None, (40, 60)), stretched == 0)
+    colour: np.ndarray = np.zeros((40, 60, 3), dtype=np.uint8)
+    colour[..., 1] = stretched
+    assert np.array_equal(load_mask(colour, capture, None, (40, 60, 3)), stretched == 0)
+
+    # Cropped like the frames, then stretched to the size of the downscaled frames
+    cropped: np.ndarray = load_mask(stretched, capture, (10, 4, 20, 12), (12, 20))
+    assert np.array_equal(cropped, stretched[4:16, 10:30] == 0)
+    downscaled: np.ndarray = load_mask(stretched, capture, None, (20, 30))
+    assert np.array_equal(downscaled, ignored == 0)
+
+
+def test_load_mask_rejects_unusable_masks(tmp_path, capsys) -> None:
+    pytest.importorskip("cv2")
+    from AutoMerge import load_mask
+
+    capture: FrameCapture = FrameCapture([np.zeros((40, 60, 3), dtype=np.uint8)])
+    assert load_mask(np.ones((40, 60), dtype=np.uint8), capture, None, (40, 60)) is None
+    assert "ignores every pixel" in capsys.readouterr().out
+    assert load_mask(str(tmp_path / "missing.png"), capture, None, (40, 60)) is None
+    assert "Error opening mask" in capsys.readouterr().out
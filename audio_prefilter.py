@@ -0,0 +1,192 @@
+"""Estimates the alignment of two videos from their audio.
+
+Extracts a low rate energy envelope of the audio at the end of the leading video
+and the beginning of the following video, using a local ffmpeg, and finds the
+offset between them with FFT cross-correlation. The offset narrows the visual
+search down to a band of frame pairs, instead of every pair.
+
+  Typical usage example:
+
+  lead_envelope = get_audio_envelope("path/to/vid1.avi", start=57.0, duration=3)
+  following_envelope = get_audio_envelope("path/to/vid2.avi", start=0.0, duration=3)
+  band = get_audio_band(lead_envelope, following_envelope, lead_fps=25.0, following_fps=25.0, band_seconds=0.5)
+"""
+from __future__ import annotations
+import math
+import shutil
+import subprocess
+from typing import *
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Audio is decoded as mono at SAMPLE_RATE Hz and reduced to ENVELOPE_RATE energy values per second
+SAMPLE_RATE: int = 8000
+ENVELOPE_RATE: int = 100
+
+# Correlation below this is considered no match, and the full search is used
+MIN_CORRELATION: float = 0.5
+
+# Offsets where the envelopes overlap by less than this many seconds are not considered
+MIN_OVERLAP_SECONDS: float = 0.3
+
+# The best offset must stand out, the best score at offsets more than PEAK_EXCLUSION_SECONDS away
+# must be below MAX_RUNNER_UP_RATIO times the best score, else the audio is considered ambiguous
+PEAK_EXCLUSION_SECONDS: float = 0.1
+MAX_RUNNER_UP_RATIO: float = 0.6
+
+
+def get_audio_envelope(path: str, start: float, duration: float) -> Union[np.ndarray, None]:
+    """Gets the log energy envelope of the audio of a video.
+
+    Args:
+        path: A string representing a path to the video file.
+        start: A float representing the time in seconds to start from.
+        duration: A float representing the number of seconds to get.
+
+    Returns:
+        An ndarray of ENVELOPE_RATE log RMS energy values per second,
+        or None if ffmpeg is not installed or the video has no audio.
+    """
+
+    import numpy as np
+
+    ffmpeg: Union[str, None] = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        return None
+
+    command: List[str] = [ffmpeg, "-nostdin", "-v", "error", "-ss", str(max(start, 0.0)), "-t", str(duration),
+                          "-i", path, "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "-"]
+    result: subprocess.CompletedProcess = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if result.returncode != 0:
+        return None
+
+    samples: np.ndarray = np.frombuffer(result.stdout, dtype=np.int16).astype(np.float64)
+    window: int = SAMPLE_RATE // ENVELOPE_RATE
+    number_of_windows: int = len(samples) // window
+    if number_of_windows < 2:
+        return None
+
+    windows: np.ndarray = samples[:number_of_windows * window].reshape(number_of_windows, window)
+    return np.log1p(np.sqrt(np.mean(windows ** 2, axis=1)))
+
+
+def estimate_offset(lead_envelope: np.ndarray,
+                    following_envelope: np.ndarray) -> Union[Tuple[float, float, float], None]:
+    """Estimates the offset between two envelopes with FFT cross-correlation.
+
+    Each offset is scored by the correlation of the overlapping parts of the envelopes,
+    normalised with the mean and standard deviation of those parts only.
+    Short overlaps correlate well by chance more often than long ones, so offsets are
+    ranked by the significance of their correlation, its Fisher transform times the square root
+    of the overlap length, rather than by the correlation itself.
+    Offsets where the envelopes overlap by less than MIN_OVERLAP_SECONDS are not considered.
+
+    Args:
+        lead_envelope: An ndarray representing the envelope of the end of the leading video.
+        following_envelope: An ndarray representing the envelope of the beginning of the following video.
+
+    Returns:
+        A tuple of three floats, the offset in seconds, the correlation at that offset,
+        and the ratio of the best score more than PEAK_EXCLUSION_SECONDS away to the score of the offset,
+        where time t in the following envelope matches time t + offset in the leading envelope.
+        None if no offset overlaps enough, or the overlapping parts are silent or constant.
+    """
+
+    import numpy as np
+
+    lead: np.ndarray = np.asarray(lead_envelope, dtype=np.float64)
+    following: np.ndarray = np.asarray(following_envelope, dtype=np.float64)
+    # Remove the overall means first, it doesn't change the correlations but keeps the sums below small
+    lead = lead - lead.mean()
+    following = following - following.mean()
+
+    lead_length: int = len(lead)
+    following_length: int = len(following)
+    size: int = 1 << (lead_length + following_length - 1).bit_length()
+    # cross[lag] = sum over t of lead[t + lag] * following[t], negative lags wrap around to the end
+    cross: np.ndarray = np.fft.irfft(np.fft.rfft(lead, size) * np.conj(np.fft.rfft(following, size)), size)
+
+    # At each lag, lead[lead_start:lead_end] overlaps following[following_start:following_end]
+    lags: np.ndarray = np.arange(-(following_length - 1), lead_length)
+    lead_start: np.ndarray = np.maximum(0, lags)
+    lead_end: np.ndarray = np.minimum(lead_length, following_length + lags)
+    following_start: np.ndarray = np.maximum(0, -lags)
+    following_end: np.ndarray = np.minimum(following_length, lead_length - lags)
+    overlaps: np.ndarray = lead_end - lead_start
+
+    # Sums and sums of squares of the overlapping parts, from cumulative sums
+    def overlap_sums(values: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        sums: np.ndarray = np.concatenate(([0.0], np.cumsum(values)))
+        squares: np.ndarray = np.concatenate(([0.0], np.cumsum(values ** 2)))
+        return sums[ends] - sums[starts], squares[ends] - squares[starts]
+
+    lead_sums, lead_squares = overlap_sums(lead, lead_start, lead_end)
+    following_sums, following_squares = overlap_sums(following, following_start, following_end)
+
+    counts: np.ndarray = np.maximum(overlaps, 1)
+    covariances: np.ndarray = cross[lags] - lead_sums * following_sums / counts
+    lead_variances: np.ndarray = np.maximum(lead_squares - lead_sums ** 2 / counts, 0.0)
+    following_variances: np.ndarray = np.maximum(following_squares - following_sums ** 2 / counts, 0.0)
+    deviations: np.ndarray = np.sqrt(lead_variances * following_variances)
+
+    valid: np.ndarray = (overlaps >= max(MIN_OVERLAP_SECONDS * ENVELOPE_RATE, 2)) & (deviations > 1e-12 * counts)
+    if not valid.any():
+        return None
+
+    correlations: np.ndarray = np.clip(covariances / np.where(valid, deviations, 1.0), -1.0, 1.0)
+    scores: np.ndarray = np.where(valid, np.arctanh(np.clip(correlations, -0.999999, 0.999999))
+                                  * np.sqrt(np.maximum(overlaps - 3, 1)), -np.inf)
+
+    best: int = int(np.argmax(scores))
+    far: np.ndarray = valid & (np.abs(lags - lags[best]) > PEAK_EXCLUSION_SECONDS * ENVELOPE_RATE)
+    runner_up_ratio: float = 0.0
+    if far.any() and scores[best] > 0:
+        runner_up_ratio = max(float(scores[far].max() / scores[best]), 0.0)
+
+    return float(lags[best]) / ENVELOPE_RATE, float(correlations[best]), runner_up_ratio
+
+
+def get_audio_band(lead_envelope: Union[np.ndarray, None], following_envelope: Union[np.ndarray, None],
+                   lead_fps: float, following_fps: float, band_seconds: float = 0.5,
+                   verbose: int = 0) -> Union[Tuple[float, float, int], None]:
+    """Gets the band of frame pairs to search, from the audio offset between two videos.
+
+    Args:
+        lead_envelope: An ndarray representing the envelope of the searched end of the leading video, or None.
+        following_envelope: An ndarray representing the envelope of the searched beginning
+                            of the following video, or None.
+        lead_fps: A float representing the frame rate of the leading video.
+        following_fps: A float representing the frame rate of the following video.
+        band_seconds: A float representing how far from the audio offset to search, in seconds.
+        verbose: An int controlling the printing of detailed information,
+                 if verbose >= 2 the found offset and correlation are printed.
+
+    Returns:
+        A tuple of a float slope, a float intercept, and an int half width, see get_most_similar_frames,
+        so leading frame i is only compared to following frames within half width of slope * i + intercept.
+        Or None if there is no audio, the correlation is too weak to trust, or another offset matches almost as well.
+    """
+
+    if lead_envelope is None or following_envelope is None:
+        if verbose >= 1:
+            print("No audio found, or ffmpeg is not installed, searching all frame pairs")
+        return None
+
+    estimate: Union[Tuple[float, float, float], None] = estimate_offset(lead_envelope, following_envelope)
+    if estimate is None or estimate[1] < MIN_CORRELATION:
+        if verbose >= 1:
+            print("Audio does not match, searching all frame pairs")
+        return None
+
+    offset, correlation, runner_up_ratio = estimate
+    if verbose >= 2:
+        print("Audio offset", round(offset, 3), "seconds, correlation", round(correlation, 3),
+              "runner up ratio", round(runner_up_ratio, 3))
+    if runner_up_ratio >= MAX_RUNNER_UP_RATIO:
+        if verbose >= 1:
+            print("Audio offset is ambiguous, searching all frame pairs")
+        return None
+
+    # Leading frame i is at i / lead_fps seconds, which matches (i / lead_fps - offset) seconds in the following video
+    return (following_fps / lead_fps, -offset * following_fps, int(math.ceil(band_seconds * following_fps)))
@@ -1,6 +1,8 @@
 import click
 import os
 import stat
+import socket
+import ipaddress
 
 
 class Method(click.ParamType):
@@ -14,6 +16,42 @@ class Method(click.ParamType):
             self.fail('Must be one of: mse, nrmse, psnr, ssim.', param, ctx)
 
 
+class CropBox(click.ParamType):
+    def __init__(self):
+        self.name = "crop_box"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, tuple):
+            return value
+
+        try:
+            x, y, width, height = (int(number) for number in value.split(','))
+        except ValueError:
+            self.fail('Must be four comma separated integers with no spaces: x,y,width,height.', param, ctx)
+
+        if x < 0 or y < 0 or width < 1 or height < 1:
+            self.fail('x and y must be 0 or greater, and width and height must be greater than 0.', param, ctx)
+
+        return x, y, width, height
+
+
+class LoopbackHost(click.ParamType):
+    def __init__(self):
+        self.name = "loopback_host"
+
+    def convert(self, value, param, ctx):
+        try:
+            addresses = {info[4][0] for info in socket.getaddrinfo(value, None)}
+        except socket.gaierror:
+            self.fail('Unknown host "%s".' % value, param, ctx)
+
+        # Scoped IPv6 addresses end with %interface
+        if not all(ipaddress.ip_address(address.split('%')[0]).is_loopback for address in addresses):
+            self.fail('Must be a loopback address, such as 127.0.0.1, ::1, or localhost.', param, ctx)
+
+        return value
+
+
 class PathList(click.ParamType):
     def __init__(self):
         self.name = "path_list"
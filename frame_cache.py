@@ -0,0 +1,77 @@
+"""An in-memory cache of decoded frames, shared between searches.
+
+Used by the match daemon to keep the decoded ends of recently searched
+videos around, so repeated searches on the same videos skip decoding.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import *
+
+
+class FrameCache:
+    """A thread-safe least recently used cache of decoded frame stacks, bounded by size in bytes.
+
+    Attributes:
+        max_bytes: An int representing the maximum total size of the cached frames in bytes.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes: int = max_bytes
+        self._stacks: OrderedDict = OrderedDict()
+        self._bytes: int = 0
+        self._hits: int = 0
+        self._misses: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def make_key(path: str, start: int, number_of_frames: int, multichannel: bool, downscale: bool,
+                 crop: Union[Tuple[int, int, int, int], None] = None) -> Union[Tuple, None]:
+        """Makes a key for a stack of frames, or None if the file at path can't be read.
+
+        The key includes the size and modification time of the file, so changed files miss the cache.
+        """
+
+        try:
+            stat: os.stat_result = os.stat(path)
+        except OSError:
+            return None
+        return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns,
+                start, number_of_frames, bool(multichannel), bool(downscale), crop)
+
+    def get(self, key: Union[Tuple, None]) -> Union[List, None]:
+        """Returns the stack of frames stored under key, or None if it's not cached."""
+
+        with self._lock:
+            if key is None or key not in self._stacks:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._stacks.move_to_end(key)
+            return self._stacks[key]
+
+    def put(self, key: Union[Tuple, None], frames: List) -> None:
+        """Stores a stack of frames under key, evicting the least recently used stacks to make room.
+
+        Stacks larger than max_bytes are not cached.
+        """
+
+        size: int = sum(frame.nbytes for frame in frames)
+        if key is None or size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._stacks:
+                self._bytes -= sum(frame.nbytes for frame in self._stacks.pop(key))
+            while self._stacks and self._bytes + size > self.max_bytes:
+                _, evicted = self._stacks.popitem(last=False)
+                self._bytes -= sum(frame.nbytes for frame in evicted)
+            self._stacks[key] = frames
+            self._bytes += size
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of cached stacks, their size in bytes, and the number of hits and misses."""
+
+        with self._lock:
+            return {"stacks": len(self._stacks), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self._hits, "misses": self._misses}
@@ -0,0 +1,309 @@
+"""A long running match daemon, and a thin client for it.
+
+The daemon keeps AutoMerge and its dependencies imported and a cache of
+decoded frames in memory, and serves find_matching_frames over HTTP on localhost.
+The client only needs click and the standard library, so it starts quickly.
+
+The daemon has no authentication, and opens any video or mask path a client sends,
+so it only listens on loopback addresses.
+
+  Typical usage example:
+
+  python match_daemon.py serve --port 8765 --frame-cache 2048
+  python match_daemon.py match path/to/vid1.avi [path/to/vid2.avi,path/to/vid3.avi] 3 mse --colour
+"""
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import *
+import click
+from custom_params import PathList, Method, CropBox, LoopbackHost
+
+DEFAULT_HOST: str = "127.0.0.1"
+DEFAULT_PORT: int = 8765
+METHODS: List[str] = ["mse", "nrmse", "psnr", "ssim"]
+
+
+class MatchServer(ThreadingHTTPServer):
+    """An HTTP server running searches on a bounded number of worker threads.
+
+    Each request is handled on its own thread, but at most max_workers searches run at a time.
+    Up to max_queue requests wait for a free worker, further requests are turned away
+    with 503 Service Unavailable, so the client can back off and retry.
+
+    Attributes:
+        find_matching_frames: The find_matching_frames function, imported once when the server starts.
+        frame_cache: A FrameCache shared between all searches.
+        max_workers: An int representing the number of searches to run at a time.
+        max_queue: An int representing the number of requests allowed to wait for a worker.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], find_matching_frames: Callable, frame_cache,
+                 max_workers: int, max_queue: int, verbose: int = 0):
+        # Bind IPv6 addresses, such as ::1, with an IPv6 socket
+        self.address_family = socket.getaddrinfo(address[0], address[1], type=socket.SOCK_STREAM)[0][0]
+        super().__init__(address, MatchRequestHandler)
+        self.find_matching_frames: Callable = find_matching_frames
+        self.frame_cache = frame_cache
+        self.max_workers: int = max_workers
+        self.max_queue: int = max_queue
+        self.verbose: int = verbose
+
+        self._workers: threading.BoundedSemaphore = threading.BoundedSemaphore(max_workers)
+        self._lock: threading.Lock = threading.Lock()
+        self._admitted: int = 0
+        self._served: int = 0
+        self._rejected: int = 0
+
+    def admit(self) -> bool:
+        """Admits a request if there is a free worker or room in the queue, else returns False."""
+        with self._lock:
+            if self._admitted >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                return False
+            self._admitted += 1
+            return True
+
+    def run(self, request: Dict[str, Any]) -> List[Union[Tuple[int, int, float], None]]:
+        """Runs a search on an admitted request once a worker is free."""
+        try:
+            with self._workers:
+                return self.find_matching_frames(request["lead"], request["following"], request["seconds"],
+                                                 request.get("colour", False), request.get("downscale", True),
+                                                 request["method"], request.get("verbose", 0),
+                                                 None, request.get("cache", False),
+                                                 frame_cache=self.frame_cache, audio=request.get("audio", False),
+                                                 audio_band=request.get("audio_band", 0.5),
+                                                 crop=request.get("crop"), mask=request.get("mask"))
+        finally:
+            with self._lock:
+                self._admitted -= 1
+                self._served += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = {"admitted": self._admitted, "served": self._served, "rejected": self._rejected,
+                                   "max_workers": self.max_workers, "max_queue": self.max_queue}
+        out["frame_cache"] = self.frame_cache.stats()
+        return out
+
+
+class MatchRequestHandler(BaseHTTPRequestHandler):
+    """Handles POST /match and GET /stats requests, see match_daemon.py match for the request format."""
+
+    server: MatchServer
+
+    def send_json(self, status: int, body: Dict[str, Any], headers: Union[Dict[str, str], None] = None) -> None:
+        data: bytes = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path == "/stats":
+            self.send_json(200, self.server.stats())
+        else:
+            self.send_json(404, {"error": "Unknown path " + self.path})
+
+    def do_POST(self) -> None:
+        if self.path != "/match":
+            self.send_json(404, {"error": "Unknown path " + self.path})
+            return
+
+        try:
+            request: Dict[str, Any] = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            error: Union[str, None] = validate_request(request)
+        except (ValueError, TypeError) as exception:
+            error = "Invalid JSON: " + str(exception)
+        if error:
+            self.send_json(400, {"error": error})
+            return
+
+        if not self.server.admit():
+            self.send_json(503, {"error": "Too many requests, try again later"}, {"Retry-After": "1"})
+            return
+
+        try:
+            results = self.server.run(request)
+        except Exception as exception:
+            self.send_json(500, {"error": type(exception).__name__ + ": " + str(exception)})
+            return
+        self.send_json(200, {"results": results})
+
+    def log_message(self, format: str, *args) -> None:
+        if self.server.verbose >= 1:
+            super().log_message(format, *args)
+
+
+def is_integer(value: Any) -> bool:
+    """Checks if value is a JSON integer, bool is a subclass of int in Python but not a number in JSON."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def validate_request(request: Any) -> Union[str, None]:
+    """Checks a match request, returns an error message if it's invalid, or None if it's valid."""
+
+    if not isinstance(request, dict):
+        return "Request must be a JSON object"
+    if not isinstance(request.get("lead"), str):
+        return "lead must be a path"
+    following = request.get("following")
+    if not isinstance(following, list) or not following or not all(isinstance(path, str) for path in following):
+        return "following must be a non-empty list of paths"
+    if not is_integer(request.get("seconds")) or request["seconds"] < 1:
+        return "seconds must be an integer greater than 0"
+    verbose = request.get("verbose", 0)
+    if not is_integer(verbose) or not 0 <= verbose <= 3:
+        return "verbose must be an integer from 0 to 3"
+    for name in ["colour", "downscale", "cache", "audio"]:
+        if not isinstance(request.get(name, False), bool):
+            return name + " must be true or false"
+    if request.get("method") not in METHODS:
+        return "method must be one of: " + ", ".join(METHODS)
+    if request.get("max_memory") is not None:
+        # The budget is measured against the memory usage of the whole process,
+        # which in the daemon includes the frame cache and any other running searches
+        return "max_memory is not supported by the daemon, use AutoMerge.py --max-memory instead"
+    audio_band = request.get("audio_band", 0.5)
+    if not (is_integer(audio_band) or isinstance(audio_band, float)) or not audio_band >= 0:
+        return "audio_band must be a number of seconds"
+    crop = request.get("crop")
+    if crop is not None and (not isinstance(crop, list) or len(crop) != 4
+                             or not all(is_integer(value) for value in crop)
+                             or min(crop[:2]) < 0 or min(crop[2:]) < 1):
+        return "crop must be a list of x, y, width, and height"
+    if request.get("mask") is not None and not isinstance(request["mask"], str):
+        return "mask must be a path"
+    return None
+
+
+def get_url(host: str, port: int, path: str = "") -> str:
+    """Returns the URL of path on the daemon at host and port, with IPv6 addresses in brackets."""
+    if ":" in host:
+        host = "[" + host + "]"
+    return "http://" + host + ":" + str(port) + path
+
+
+@click.group()
+def cli() -> None:
+    """Runs or talks to a long running AutoMerge match daemon."""
+
+
+@cli.command(options_metavar='<options>')
+@click.option("--host", type=LoopbackHost(), default=DEFAULT_HOST,
+              help='loopback address to listen on (default ' + DEFAULT_HOST + ')')
+@click.option("--port", type=click.IntRange(min=0, max=65535), default=DEFAULT_PORT,
+              help='port to listen on (default ' + str(DEFAULT_PORT) + ')')
+@click.option("--workers", type=click.IntRange(min=1, max=None, clamp=False), default=2,
+              help='number of searches to run at a time (default 2)')
+@click.option("--queue", type=click.IntRange(min=0, max=None, clamp=False), default=16,
+              help='number of requests to queue before turning them away (default 16)')
+@click.option("--frame-cache", type=click.IntRange(min=0, max=None, clamp=False), default=1024,
+              metavar='<megabytes>', help='size of the decoded frame cache in megabytes (default 1024)')
+@click.option("--verbose", type=click.IntRange(min=0, max=1, clamp=False), default=0,
+              help='0 = nothing, 1 = log requests')
+def serve(host: str, port: int, workers: int, queue: int, frame_cache: int, verbose: int) -> None:
+    """Starts a match daemon, serving find_matching_frames over HTTP.
+
+    The daemon has no authentication and opens any path it's sent, so it only listens on loopback addresses.
+    """
+
+    # Import the heavy dependencies once, here, rather than in every client
+    from AutoMerge import find_matching_frames, import_dependencies
+    from frame_cache import FrameCache
+    import_dependencies()
+
+    server: MatchServer = MatchServer((host, port), find_matching_frames, FrameCache(frame_cache * 1024 * 1024),
+                                      workers, queue, verbose)
+    print("Serving on", get_url(host, server.server_address[1]), "with", workers, "workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@cli.command(context_settings={"ignore_unknown_options": True}, options_metavar='<options>')
+@click.argument("lead_vid_path", type=click.Path(exists=True, dir_okay=False, readable=True), metavar='<leading video>')
+@click.argument("following_vids_paths", type=PathList(), metavar='<following videos>')
+@click.argument("seconds", type=click.IntRange(min=1, max=None, clamp=False), metavar='<seconds>')
+@click.argument("method", type=Method(), metavar='<method>')
+@click.option("--verbose", type=click.IntRange(min=0, max=3, clamp=False), default=0,
+              help='0 = nothing, 1 = stage of operation, 2 = threading and time, 3 = detailed processing, '
+                   'printed by the daemon')
+@click.option('--colour/--greyscale', default=False, help='colour on / off (default off)')
+@click.option('--downscale/--no-downscale', default=True, help='downscale on / off (default on)')
+@click.option('--cache/--no-cache', default=False, help='persistent result cache on / off (default off)')
+@click.option('--audio/--no-audio', default=False,
+              help='align by audio first and only search frames near the audio offset, needs ffmpeg (default off)')
+@click.option("--audio-band", type=click.FloatRange(min=0, max=None, clamp=False), default=0.5, metavar='<seconds>',
+              help='how far from the audio offset to search, in seconds (default 0.5)')
+@click.option("--crop", type=CropBox(), default=None, metavar='<x,y,width,height>',
+              help='only search this rectangle of the frames, in pixels of the original frames (default whole frames)')
+@click.option("--mask", type=click.Path(exists=True, dir_okay=False, readable=True), default=None, metavar='<image>',
+              help='image the size of the frames, non-zero pixels are ignored when comparing (default no mask)')
+@click.option("--host", default=DEFAULT_HOST, help='address of the daemon (default ' + DEFAULT_HOST + ')')
+@click.option("--port", type=click.IntRange(min=1, max=65535), default=DEFAULT_PORT,
+              help='port of the daemon (default ' + str(DEFAULT_PORT) + ')')
+@click.option("--retries", type=click.IntRange(min=0, max=None, clamp=False), default=10,
+              help='number of times to retry when the daemon is busy (default 10)')
+def match(lead_vid_path: str, following_vids_paths: List[str], seconds: int, method: str, verbose: int,
+          colour: bool, downscale: bool, cache: bool,
+          audio: bool, audio_band: float, crop: Union[Tuple[int, int, int, int], None], mask: Union[str, None],
+          host: str, port: int, retries: int) -> None:
+    """Asks a running match daemon to find the best matching frames,
+    takes the same arguments as AutoMerge.py, except --max-memory.
+    """
+
+    # The daemon may run in another directory, so send absolute paths
+    request: Dict[str, Any] = {"lead": os.path.abspath(lead_vid_path),
+                               "following": [os.path.abspath(path) for path in following_vids_paths],
+                               "seconds": seconds, "method": method, "verbose": verbose, "colour": colour,
+                               "downscale": downscale, "cache": cache,
+                               "audio": audio, "audio_band": audio_band,
+                               "crop": None if crop is None else list(crop),
+                               "mask": None if mask is None else os.path.abspath(mask)}
+    data: bytes = json.dumps(request).encode()
+    url: str = get_url(host, port, "/match")
+
+    for attempt in range(retries + 1):
+        http_request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(http_request) as response:
+                results = json.loads(response.read())["results"]
+            break
+        except urllib.error.HTTPError as error:
+            if error.code == 503 and attempt < retries:
+                # The daemon is busy, back off before retrying
+                time.sleep(float(error.headers.get("Retry-After", 1)) * (attempt + 1))
+                continue
+            try:
+                message: str = json.loads(error.read())["error"]
+            except (ValueError, KeyError):
+                message = error.reason
+            print("Error from match daemon:", message)
+            sys.exit(1)
+        except urllib.error.URLError as error:
+            print("No match daemon running at", host + ":" + str(port), "(" + str(error.reason) + ")")
+            print("Start one with: python match_daemon.py serve")
+            sys.exit(1)
+
+    # Print in the same format as AutoMerge.py
+    print(results if results is None else [None if result is None else tuple(result) for result in results])
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,156 @@
+"""Helpers for keeping a frame search within a memory budget.
+
+Splits the grid of leading and following frame pairs into tiles that fit
+in a given number of bytes, and spills decoded frames that don't fit in
+memory to scratch files on disk.
+
+NumPy is imported by the functions that need it, so importing this module is cheap.
+"""
+from __future__ import annotations
+import os
+import sys
+from typing import *
+
+if TYPE_CHECKING:
+    import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+MEGABYTE: int = 1024 * 1024
+
+# Rough number of bytes of temporary memory each similarity method needs per byte of frame,
+# skimage converts both frames to float64 and keeps a few intermediate images around.
+WORKING_MEMORY_FACTORS: Dict[str, int] = {'mse': 24, 'nrmse': 32, 'psnr': 24, 'ssim': 112}
+
+
+class SpilledFrames:
+    """A stack of frames stored in a scratch file.
+
+    Frames are written with append() and read back in blocks by slicing.
+    Both use plain file reads and writes rather than a memory map,
+    because pages of a mapped file count towards the memory usage of the process
+    for as long as it's mapped. This way only the block being read is held in memory.
+
+    Attributes:
+        path: A string representing the path to the scratch file.
+        frame_shape: A tuple representing the shape of a single frame.
+    """
+
+    def __init__(self, path: str, frame_shape: Tuple[int, ...]):
+        self.path: str = path
+        self.frame_shape: Tuple[int, ...] = frame_shape
+        self._length: int = 0
+        self._writer: Union[BinaryIO, None] = open(path, "wb")
+
+    def append(self, frame: np.ndarray) -> None:
+        import numpy as np
+
+        if frame.shape != self.frame_shape:
+            raise ValueError("Frame of shape " + str(frame.shape) + " does not fit in a stack of frames of shape "
+                             + str(self.frame_shape))
+        np.ascontiguousarray(frame, dtype=np.uint8).tofile(self._writer)
+        self._length += 1
+
+    def close(self) -> None:
+        """Flushes and closes the scratch file, must be called before reading."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, key: slice) -> np.ndarray:
+        import numpy as np
+
+        start, stop, step = key.indices(self._length)
+        if step != 1:
+            raise ValueError("SpilledFrames only supports contiguous slices")
+        if stop <= start:
+            return np.empty((0,) + self.frame_shape, dtype=np.uint8)
+
+        frame_bytes: int = int(np.prod(self.frame_shape))
+        block: np.ndarray = np.fromfile(self.path, dtype=np.uint8, count=(stop - start) * frame_bytes,
+                                        offset=start * frame_bytes)
+        return block.reshape((stop - start,) + self.frame_shape)
+
+
+def plan_tiles(lead_length: int, lead_frame_bytes: int, following_length: int, following_frame_bytes: int,
+               budget: int, lead_in_memory: bool, following_in_memory: bool) -> Tuple[int, int]:
+    """Plans how to split the grid of frame pairs into tiles that fit in budget.
+
+    Stacks kept in memory are always loaded whole. Of the spilled stacks,
+    the smaller one is kept resident if there is room for it and at least one
+    frame of the other, which is then streamed in blocks. If neither fits,
+    the budget is split evenly between the two.
+
+    Args:
+        lead_length: An int representing the number of leading frames.
+        lead_frame_bytes: An int representing the size of a leading frame in bytes.
+        following_length: An int representing the number of following frames.
+        following_frame_bytes: An int representing the size of a following frame in bytes.
+        budget: An int representing the number of bytes available for frames.
+        lead_in_memory: A bool telling if the leading frames are kept in memory.
+        following_in_memory: A bool telling if the following frames are kept in memory.
+
+    Returns:
+        A tuple of two ints, the number of leading and following frames in each tile.
+        Both are at least 1, even if the budget is too small to hold a single tile.
+    """
+
+    def clamp(block: int, length: int) -> int:
+        return max(1, min(block, length))
+
+    lead_bytes: int = lead_length * lead_frame_bytes
+    following_bytes: int = following_length * following_frame_bytes
+
+    remaining: int = budget
+    if lead_in_memory:
+        remaining -= lead_bytes
+    if following_in_memory:
+        remaining -= following_bytes
+
+    if lead_in_memory and following_in_memory:
+        return clamp(lead_length, lead_length), clamp(following_length, following_length)
+    if lead_in_memory:
+        return clamp(lead_length, lead_length), clamp(remaining // following_frame_bytes, following_length)
+    if following_in_memory:
+        return clamp(remaining // lead_frame_bytes, lead_length), clamp(following_length, following_length)
+
+    # Both are spilled, keep the smaller one resident and stream the other
+    if lead_bytes <= following_bytes and lead_bytes + following_frame_bytes <= remaining:
+        return (clamp(lead_length, lead_length),
+                clamp((remaining - lead_bytes) // following_frame_bytes, following_length))
+    if following_bytes < lead_bytes and following_bytes + lead_frame_bytes <= remaining:
+        return (clamp((remaining - following_bytes) // lead_frame_bytes, lead_length),
+                clamp(following_length, following_length))
+
+    # Neither fits, split the budget evenly
+    return (clamp((remaining // 2) // lead_frame_bytes, lead_length),
+            clamp((remaining // 2) // following_frame_bytes, following_length))
+
+
+def get_memory_usage() -> int:
+    """Returns the current resident set size of the process in bytes, or 0 if unknown."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        # Not on Linux, the peak is the best estimate available
+        return get_peak_memory_usage()
+
+
+def get_peak_memory_usage() -> int:
+    """Returns the peak resident set size of the process in bytes, or 0 if unknown."""
+    if resource is None:
+        return 0
+
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes everywhere else
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
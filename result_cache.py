@@ -0,0 +1,324 @@
+"""A persistent cache of the results of find_matching_frames.
+
+Results are stored in an SQLite database, keyed by a fingerprint of the content
+of the leading and following video files and the search parameters,
+so renamed or copied files still hit the cache, and changed files don't.
+
+  Typical usage example:
+
+  result_cache = ResultCache()
+  result = result_cache.get("path/to/vid1.avi", "path/to/vid2.avi", seconds=3, multichannel=False,
+                            downscale=True, method="mse")
+
+  The cache can be inspected and invalidated from the command line:
+
+  python result_cache.py stats
+  python result_cache.py clear [<videos>]
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import contextlib
+from typing import *
+import click
+
+# Bump when the search changes in a way that changes results, to invalidate old entries
+CACHE_VERSION: int = 1
+
+# Number of bytes hashed at the head and tail of a file, and at each sample in between
+EDGE_BYTES: int = 64 * 1024
+SAMPLE_BYTES: int = 4 * 1024
+NUMBER_OF_SAMPLES: int = 16
+
+
+def get_default_cache_dir() -> str:
+    """Returns the directory to keep the cache in.
+
+    Uses $AUTOMERGE_CACHE_DIR if set, else $XDG_CACHE_HOME/automerge, else ~/.cache/automerge.
+    """
+
+    cache_dir: Union[str, None] = os.environ.get("AUTOMERGE_CACHE_DIR")
+    if cache_dir:
+        return cache_dir
+
+    cache_home: str = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "automerge")
+
+
+def fingerprint_file(path: str) -> str:
+    """Calculates a fast fingerprint of the content of a file.
+
+    Hashes the file size, the first and last EDGE_BYTES bytes,
+    and NUMBER_OF_SAMPLES samples of SAMPLE_BYTES bytes spread evenly in between,
+    so the cost is independent of the size of the file.
+
+    Args:
+        path: A string representing the path to the file.
+
+    Returns:
+        A string with the hex digest of the fingerprint.
+
+    Raises:
+        OSError: If the file can't be read.
+    """
+
+    size: int = os.path.getsize(path)
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(str(size).encode())
+
+    with open(path, "rb") as file:
+        if size <= 2 * EDGE_BYTES + NUMBER_OF_SAMPLES * SAMPLE_BYTES:
+            digest.update(file.read())
+        else:
+            digest.update(file.read(EDGE_BYTES))
+            step: int = (size - 2 * EDGE_BYTES) // (NUMBER_OF_SAMPLES + 1)
+            for sample in range(1, NUMBER_OF_SAMPLES + 1):
+                file.seek(EDGE_BYTES + sample * step)
+                digest.update(file.read(SAMPLE_BYTES))
+            file.seek(size - EDGE_BYTES)
+            digest.update(file.read(EDGE_BYTES))
+
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """A persistent cache of search results for pairs of leading and following videos.
+
+    Lookups only read the database. Hits and misses are counted in memory
+    and added to the stored statistics by flush_stats, so a cache in a read-only
+    directory can still be read from. If the database can't be opened at all,
+    every lookup is a miss and results are not stored.
+
+    Attributes:
+        path: A string representing the path to the SQLite database.
+    """
+
+    def __init__(self, cache_dir: Union[str, None] = None):
+        if cache_dir is None:
+            cache_dir = get_default_cache_dir()
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        except OSError:
+            # Opening the database fails too, and is handled there
+            pass
+
+        self.path: str = os.path.join(cache_dir, "results.sqlite")
+        self._fingerprints: Dict[Tuple[str, int, int], str] = {}
+        self._hits: int = 0
+        self._misses: int = 0
+
+        try:
+            with self._connect() as connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS results ("
+                                   "key TEXT PRIMARY KEY, lead_fingerprint TEXT, following_fingerprint TEXT, "
+                                   "lead_frame INTEGER, following_frame INTEGER, score REAL, created REAL)")
+                connection.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)")
+                connection.execute("INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0)")
+        except sqlite3.OperationalError:
+            # Read-only, the database can still be read if it exists
+            pass
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # A timeout lets several processes share the cache
+        connection: sqlite3.Connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def fingerprint(self, path: str) -> Union[str, None]:
+        """Returns the fingerprint of the file at path, or None if it can't be read.
+
+        Fingerprints are remembered for as long as the file size and modification time are unchanged.
+        """
+
+        try:
+            stat: os.stat_result = os.stat(path)
+            key: Tuple[str, int, int] = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+            if key not in self._fingerprints:
+                self._fingerprints[key] = fingerprint_file(path)
+            return self._fingerprints[key]
+        except OSError:
+            return None
+
+    @staticmethod
+    def _make_key(lead_fingerprint: str, following_fingerprint: str, seconds: int,
+                  multichannel: bool, downscale: bool, method: str,
+                  options: Union[Dict[str, Any], None] = None) -> str:
+        key: List[Any] = [CACHE_VERSION, lead_fingerprint, following_fingerprint,
+                          seconds, bool(multichannel), bool(downscale), method]
+        if options:
+            # Only added when given, so results of plain searches keep their keys
+            key.append(options)
+        parameters: str = json.dumps(key, sort_keys=True)
+        return hashlib.blake2b(parameters.encode(), digest_size=20).hexdigest()
+
+    def get(self, lead_vid_path: str, following_vid_path: str, seconds: int,
+            multichannel: bool, downscale: bool, method: str,
+            options: Union[Dict[str, Any], None] = None) -> Union[Tuple[int, int, float], None]:
+        """Looks up the result of a search in the cache.
+
+        Args:
+            lead_vid_path: A string representing a path to the leading video file.
+            following_vid_path: A string representing a path to the following video file.
+            seconds: An int representing the number of seconds searched.
+            multichannel: A bool telling if the search was made in colour or greyscale.
+            downscale: A bool telling if the search was made on downscaled frames.
+            method: A sting representing the image similarity method used.
+            options: A dict of any further search options that change the result, or None.
+
+        Returns:
+            An int, int, float tuple with the found frames and the similarity score,
+            or None if the result is not in the cache.
+        """
+
+        lead_fingerprint: Union[str, None] = self.fingerprint(lead_vid_path)
+        following_fingerprint: Union[str, None] = self.fingerprint(following_vid_path)
+        if lead_fingerprint is None or following_fingerprint is None:
+            return None
+
+        key: str = self._make_key(lead_fingerprint, following_fingerprint, seconds, multichannel, downscale, method,
+                                  options)
+        try:
+            with self._connect() as connection:
+                row = connection.execute("SELECT lead_frame, following_frame, score FROM results WHERE key = ?",
+                                         (key,)).fetchone()
+        except sqlite3.OperationalError:
+            # The database can't be opened or read
+            row = None
+
+        if row is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        # SQLite stores NaN as NULL
+        return row[0], row[1], float("nan") if row[2] is None else row[2]
+
+    def put(self, lead_vid_path: str, following_vid_path: str, seconds: int,
+            multichannel: bool, downscale: bool, method: str, result: Tuple[int, int, float],
+            options: Union[Dict[str, Any], None] = None) -> None:
+        """Stores the result of a search in the cache, see get."""
+
+        lead_fingerprint: Union[str, None] = self.fingerprint(lead_vid_path)
+        following_fingerprint: Union[str, None] = self.fingerprint(following_vid_path)
+        if lead_fingerprint is None or following_fingerprint is None:
+            return
+
+        key: str = self._make_key(lead_fingerprint, following_fingerprint, seconds, multichannel, downscale, method,
+                                  options)
+        try:
+            with self._connect() as connection:
+                connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   (key, lead_fingerprint, following_fingerprint,
+                                    int(result[0]), int(result[1]), float(result[2]), time.time()))
+        except sqlite3.OperationalError:
+            # Read-only, or locked for longer than the timeout, the result is just not cached
+            pass
+
+    def flush_stats(self) -> None:
+        """Adds the hits and misses counted since the last flush to the stored statistics.
+
+        If the database can't be written to, the counts are kept for the next flush.
+        """
+
+        if not self._hits and not self._misses:
+            return
+
+        try:
+            with self._connect() as connection:
+                connection.executemany("UPDATE stats SET value = value + ? WHERE name = ?",
+                                       [(self._hits, "hits"), (self._misses, "misses")])
+        except sqlite3.OperationalError:
+            return
+        self._hits = 0
+        self._misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of entries, hits, and misses, and the size of the database in bytes.
+
+        Hits and misses include the ones not flushed yet. If the database can't be opened or read,
+        the cache is reported as empty.
+        """
+
+        out: Dict[str, int] = {"entries": 0}
+        try:
+            with self._connect() as connection:
+                out.update(connection.execute("SELECT name, value FROM stats").fetchall())
+                out["entries"] = connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        except sqlite3.OperationalError:
+            pass
+        out["hits"] = out.get("hits", 0) + self._hits
+        out["misses"] = out.get("misses", 0) + self._misses
+        out["size"] = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+        return out
+
+    def invalidate(self, paths: Union[List[str], None] = None) -> int:
+        """Removes results from the cache.
+
+        Args:
+            paths: A list of strings representing paths to video files, whose results are removed,
+                   either as leading or following video. If None, all results are removed
+                   and the statistics are reset.
+
+        Returns:
+            An int representing the number of removed results.
+        """
+
+        with self._connect() as connection:
+            if paths is None:
+                removed: int = connection.execute("DELETE FROM results").rowcount
+                connection.execute("UPDATE stats SET value = 0")
+                self._hits = 0
+                self._misses = 0
+                return removed
+
+            removed = 0
+            for path in paths:
+                fingerprint: Union[str, None] = self.fingerprint(path)
+                if fingerprint is not None:
+                    removed += connection.execute("DELETE FROM results "
+                                                  "WHERE lead_fingerprint = ? OR following_fingerprint = ?",
+                                                  (fingerprint, fingerprint)).rowcount
+            return removed
+
+
+@click.group()
+@click.option("--cache-dir", type=click.Path(file_okay=False), default=None,
+              help='cache directory (default $AUTOMERGE_CACHE_DIR, or ~/.cache/automerge)')
+@click.pass_context
+def cli(ctx, cache_dir: Union[str, None]) -> None:
+    """Inspects and invalidates the AutoMerge result cache."""
+    ctx.obj = ResultCache(cache_dir)
+
+
+@cli.command()
+@click.pass_obj
+def stats(result_cache: ResultCache) -> None:
+    """Prints cache statistics."""
+    cache_stats: Dict[str, int] = result_cache.stats()
+    lookups: int = cache_stats["hits"] + cache_stats["misses"]
+    hit_rate: float = cache_stats["hits"] / lookups if lookups else 0.0
+
+    print("Cache:", result_cache.path)
+    print("Entries:", cache_stats["entries"])
+    print("Hits:", cache_stats["hits"])
+    print("Misses:", cache_stats["misses"])
+    print("Hit rate:", "{:.1%}".format(hit_rate))
+    print("Size:", cache_stats["size"] // 1024, "KB")
+
+
+@cli.command()
+@click.argument("paths", nargs=-1, type=click.Path(exists=True, dir_okay=False, readable=True), metavar='<videos>')
+@click.pass_obj
+def clear(result_cache: ResultCache, paths: Tuple[str, ...]) -> None:
+    """Removes the results involving <videos> from the cache, or all results if no videos are given."""
+    removed: int = result_cache.invalidate(list(paths) if paths else None)
+    print("Removed", removed, "results")
+
+
+if __name__ == "__main__":
+    cli()
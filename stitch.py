@@ -1,10 +1,6 @@
 from typing import *
 import click
-import numpy as np
-import cv2 as cv
 import os
-from AutoMerge import get_frames, resize_image
-from skimage.measure import compare_ssim
 
 
 @click.command(context_settings={"ignore_unknown_options": True})
@@ -20,6 +16,12 @@ def stitch_videos(fst_vid_path: str, snd_vid_path: str,
                   fst_stitch_frame: int, snd_stitch_frame: int,
                   fst_seconds: int = 5, snd_seconds: int = 5) -> None:
 
+    # Import the heavy dependencies here, so --help and argument errors don't wait for them
+    import numpy as np
+    import cv2 as cv
+    from skimage.measure import compare_ssim
+    from AutoMerge import get_frames, resize_image
+
     # Open in-video files
     fst_capture: cv.VideoCapture = cv.VideoCapture(fst_vid_path)
     snd_capture: cv.VideoCapture = cv.VideoCapture(snd_vid_path)